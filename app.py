@@ -1,28 +1,37 @@
 import datetime
-from sqlite3 import OperationalError
-import io
-import numpy as np
-import streamlit as st
+import time
 import pandas as pd
+import streamlit as st
 import data_requests as data_requests
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
-import base64
-import pdfkit
-
-
-def main():
-    # Layout setup:
-    st.set_page_config(page_title="Kraken Staking Calculator", page_icon=":chart_with_upwards_trend:", layout="wide")
-    st.title("Kraken Staking Calculator")
-
+import ledger as ledger
+import ledger_cache as ledger_cache
+import valuation as valuation
+from sqlalchemy.exc import OperationalError
+from streamlit.scriptrunner import StopException
+import pdf_export as pdf_export
+import instrumentation as instrumentation
+import updater as updater
+
+# seconds between reruns while a database update of the session runs in the background:
+update_refresh_seconds = 1.0
+
+
+@st.experimental_singleton
+def open_database():
+    """
+    Opens the price database once per server process, all sessions and reruns share its connection pool.
+    :return: data_requests.Database
+    """
+    data_requests.database.get_engine()
+    return data_requests.database
+
+
+def render_page():
     uploaded_file = st.file_uploader("Upload a CSV file", type=["csv"])
 
     col0, col1, col2, col3 = st.columns(4)
     with col0:
         base_currency = st.selectbox('Select base currency', ('EUR', 'USD'))
-        # used to determine if asset is in base currency
-        appendix = '_' + base_currency
 
     with col1:
         day_price = st.selectbox('Rewards sold on (daily price)', ('close', 'low', 'high'))
@@ -39,33 +48,28 @@ def main():
         st.stop()
 
     if uploaded_file is not None:
-        df = pd.read_csv(uploaded_file)
-        # preprocessing and interface check:
-        # check if all required columns are in dataframe:
-        required_columns = ["txid", "refid", "time", "type", "subtype", "aclass", "asset", "amount", "fee", "balance"]
-        if not all(col in df.columns for col in required_columns):
-            missing_columns = list(set(required_columns) - set(df.columns))
-            st.warning("Dataframe is missing the following columns: " + ', '.join(
-                missing_columns) + ". These columns are required to process the data.")
+        # parsed ledgers are cached on disk by file content:
+        ledger_hash = ledger_cache.file_hash(uploaded_file)
+        parsed_frames = ledger_cache.load_frames(ledger_hash, ['rewards', 'staking'])
+        if parsed_frames is not None:
+            rewards_df, staking_df = parsed_frames['rewards'], parsed_frames['staking']
         else:
-            # parse time to datetime objects (DatetimeIndex) in order to make time comparisons possible::
+            # preprocessing and interface check, only the staking rows of the ledger are parsed:
             try:
-                # linux timestamps
-                # df['time'] = pd.to_datetime(df['time']).map(pd.Timestamp.timestamp)
-                # DatetimeIndex
-                df['time'] = pd.to_datetime(df['time'])
-            except ValueError:
-                st.warning("An error occurred while trying to parse the 'time' column.")
-            with st.expander("Raw Data"):
-                st.dataframe(df)
-
-            # filter raw dataframe such that only staking rewards are included:
-            df = df.query('type.str.contains("staking")', engine='python')
-            df = df.groupby(['time', 'asset']).sum().reset_index()
-            rewards_df = df.pivot(index='time', columns='asset', values='amount')
+                with instrumentation.stage('ingestion'):
+                    rewards_df, staking_df = ledger.read_rewards(uploaded_file)
+            except ledger.LedgerFormatError as e:
+                st.warning(str(e))
+                st.stop()
+            ledger_cache.store_frames(ledger_hash, {'rewards': rewards_df, 'staking': staking_df})
+        if rewards_df.empty:
+            st.warning("The provided csv does not contain any staking rewards.")
+        else:
+            with st.expander("Staking Data"):
+                st.dataframe(staking_df)
 
             # Extract all column names which include staking rewards:
-            reward_assets = [col for col in rewards_df.columns if '.S' in col]
+            reward_assets = ledger.get_reward_assets(rewards_df)
 
             # min DatetimeIndex in rewards_df:
             min_datetime_index = rewards_df.index.min()
@@ -78,82 +82,52 @@ def main():
 
 
             # parse min_datetime_index to linux timestamp:
-            min_datetime_index_timestamp = start_date - datetime.timedelta(days=1)  # 1 days earlier as buffer
+            min_datetime_index_timestamp = int(datetime.datetime.combine(
+                start_date - datetime.timedelta(days=1), datetime.time(),  # 1 days earlier as buffer
+                tzinfo=datetime.timezone.utc).timestamp())
 
             st.subheader("Fiat exchange and reward overview")
 
+            # build correct ticker strings in order to request from kraken api,
+            # the assets are synced in one quote currency and converted to the base currency:
+            ticker_list = valuation.sync_tickers(reward_assets, base_currency)
+
+            # the database is only opened once a ledger needs prices:
+            open_database()
+            database_updater = updater.get_updater()
             if st.button("update exchange database"):
-                # build correct ticker strings in order to request from kraken api:
-                with st.spinner('Receiving data ...'):
-                    ticker_list = []
-                    for asset in reward_assets:
-                        asset = asset.rstrip('.S')
-                        asset = asset + base_currency
-                        ticker_list.append(asset)
-                    # update database with given ticker list:
-                    data_requests.add_list_of_ohlc(ticker_list, min_datetime_index_timestamp)
-                st.success("Updated: " + str(ticker_list) + " from last: " + str(start_date))
+                # the sync runs in the background, the page keeps showing the stored prices until new rows land:
+                # assets kraken does not list in the quote currency are synced at their direct pair instead:
+                database_updater.submit(ticker_list, min_datetime_index_timestamp,
+                                        valuation.fallback_tickers(reward_assets, base_currency))
+                st.session_state['update_tickers'] = ticker_list
+            if st.session_state.get('update_tickers') == ticker_list:
+                update_status(database_updater, ticker_list, start_date)
 
 
             # cut dataframe before start_date because database will only contian data later than start_date:
-            # Create a boolean mask based on the comparison between the dates and the given date
-            mask_rew = (rewards_df.index >= pd.to_datetime(start_date)) & (rewards_df.index <= pd.to_datetime(end_date))
-
-            # Use the mask to select only the rows that are equal to or greater than the given date
-            rewards_df = rewards_df[mask_rew]
-
-            # Calculate accumulated rewards
-            df_accumulated = rewards_df.cumsum()
-
-            for col_name in reward_assets:
-                new_col_name = col_name + appendix + "_ACC"
-                rewards_df[new_col_name] = np.nan
-                df_accumulated[new_col_name] = np.nan
-
-            # Value of each reward at receiving timestamp:
-            for date, row in rewards_df.T.iteritems():
-                for col, value in row.iteritems():
-                    if not np.isnan(value):
-                        # ticker:
-                        ticker = col.rstrip('.S')
-                        ticker = ticker + base_currency
-                        # timestamp normalized to midnight:
-                        date_normalized = date.normalize().timestamp()
-                        # print(f"Date: {date} normalized: {date.normalize()}, Column: {col}, Value: {value}")
-                        try:
-                            reward_in_base_currency = data_requests.get_ticker_from_db(ticker, date_normalized)
-                        except:
-                            st.warning("Database out of date. Please update database!")
-                            st.stop()
-                        reward_in_base_currency_val = float(value) * float(reward_in_base_currency[day_price])
-                        rewards_df.at[date, col + appendix] = str(round(reward_in_base_currency_val, 2))
-
-            # Development of value of accumulated rewards at timestamp:
-            for date, row in df_accumulated.T.iteritems():
-                for col, value in row.iteritems():
-                    if not np.isnan(value):
-                        # ticker:
-                        ticker = col.rstrip('.S')
-                        ticker = ticker + base_currency
-                        # timestamp normalized to midnight:
-                        date_normalized = date.normalize().timestamp()
-                        # print(f"Date: {date} normalized: {date.normalize()}, Column: {col}, Value: {value}")
-                        reward_in_base_currency = data_requests.get_ticker_from_db(ticker, date_normalized)
-                        # print(reward_in_base_currency)
-                        reward_in_base_currency_val = float(value) * float(reward_in_base_currency[day_price])
-                        df_accumulated.at[date, col + appendix + "_ACC"] = str(round(reward_in_base_currency_val, 2))
-
-            # Accumulate received asset in base currency on time of reward.
-            # # Just as you would have sold the rewards immediately
-            # Get columns with base_currency in their name
-            columns_of_interest = [col for col in rewards_df.columns if base_currency in col]
-            # Accumulate the values in the selected columns
-            acc_df = rewards_df[columns_of_interest].astype(float).cumsum()
-            # Rename the columns with "_ACC" suffix
-            acc_df.columns = [col + '_ONREC' for col in acc_df.columns]
-            # Concatenate the accumulated values with the original dataframe
-            rewards_df = pd.concat([rewards_df, acc_df], axis=1)
-
+            rewards_df = ledger.select_period(rewards_df, start_date, end_date)
+
+            # Value rewards on receipt and accumulated rewards in base currency,
+            # cached until the ledger, a setting or the prices of one of its tickers change:
+            valued_key = ledger_cache.make_key(ledger_hash, base_currency, day_price, start_date, end_date,
+                                               data_requests.sync_generation(
+                                                   valuation.price_tickers(reward_assets, base_currency)))
+            valued_frames = ledger_cache.load_frames(valued_key, ['rewards', 'accumulated'])
+            if valued_frames is not None:
+                rewards_df, df_accumulated = valued_frames['rewards'], valued_frames['accumulated']
+            else:
+                try:
+                    with instrumentation.stage('valuation'):
+                        rewards_df, df_accumulated = valuation.value_rewards(rewards_df, reward_assets,
+                                                                             base_currency, day_price)
+                except (data_requests.MissingPriceError, OperationalError):
+                    if database_updater.active(ticker_list):
+                        st.info("Waiting for the database update ...")
+                    else:
+                        st.warning("Database out of date. Please update database!")
+                    st.stop()
+                ledger_cache.store_frames(valued_key, {'rewards': rewards_df, 'accumulated': df_accumulated})
 
             # display dataframes on frontend:
             with st.expander("Rewards: Reward in base currency is the value of received reward at timestamp"):
@@ -161,118 +135,124 @@ def main():
             with st.expander("Accumulated Rewards: Reward in base currency is the value of total reward at timestamp"):
                 st.dataframe(df_accumulated)
 
+            # matplotlib is loaded with the first ledger shown instead of on startup:
+            import charts as charts
             with st.spinner('Generating stats ...'):
-                html_body_str = ""
-                for i, asset in enumerate(reward_assets):
-                    try:
-                        acc_worth = str(round(df_accumulated[asset + "_" + str(base_currency)  + "_ACC"].astype(float).dropna().iloc[-1], 6))
-                        acc_on_sale_worth = str(round(rewards_df[asset + "_" + str(base_currency) + "_ONREC"].astype(float).dropna().iloc[-1], 6))
-                    except IndexError:
-                        continue
-                    # first date
-                    # last date
-                    from_date = df_accumulated.index.min()
-                    to_date = df_accumulated.index.max()
-                    received_between_str = "<p>" + "Received between " + str(from_date) + " - " + str(to_date)  + "</p>"
-                    total_rewards_received_str = "<p>" + "Total reward received: " + str(round(df_accumulated[asset].max(), 6)) + ' ' + asset.rstrip('.S')  + "</p>"
+                report_sections = []
+                summary_stats_df = valuation.summarize_rewards(rewards_df, df_accumulated, reward_assets, base_currency)
+                chart_assets = [asset for asset in reward_assets if asset in summary_stats_df.index]
+                asset_charts = [(asset, base_currency,
+                                 charts.asset_chart_data(rewards_df, df_accumulated, asset, base_currency))
+                                for asset in chart_assets]
+                # every chart is rendered once (in parallel) and used for the page and the report:
+                with instrumentation.stage('charts'):
+                    chart_images = charts.render_charts(asset_charts)
+                for i, ((asset, _, chart_data), chart_image) in enumerate(zip(asset_charts, chart_images)):
+                    asset_stats = summary_stats_df.loc[asset]
+                    acc_worth = str(round(asset_stats['worth_last'], 6))
+                    acc_on_sale_worth = str(round(asset_stats['worth_on_continuous_sale'], 6))
+                    received_between_str = "<p>" + "Received between " + str(asset_stats['from']) + " - " + str(asset_stats['to'])  + "</p>"
+                    total_rewards_received_str = "<p>" + "Total reward received: " + str(round(asset_stats['total_reward'], 6)) + ' ' + asset.rstrip('.S')  + "</p>"
                     worth_total_recieved_str = "<p>" + "Worth last: " + acc_worth + " " + str(base_currency) + ". Worth on contiunous sale: " + acc_on_sale_worth + " " + str(base_currency)  + "</p>"
                     total_text_str = received_between_str + total_rewards_received_str + worth_total_recieved_str
                     # text to canvas:
                     st.subheader(str(asset))
                     st.text(total_text_str)
-                    # text to html:
-                    html_subheader_txt = f'<h3 style="padding: 0px; margin: 0px;">' + str(i) + "  " + str(asset) + "</h3>"
-                    html_short_asset_stats_txt = f'<p style="padding: 0; margin: 0;">' + total_text_str + "</p>"
-
-                    # Create figure and set axes for subplots
-                    plt.rcParams.update({'font.size': 5})
-
-                    fig = plt.figure()
-
-                    ax_rewards_bar = fig.add_axes((0, 0.7, 1, 0.1))
-                    ax_cummulated_rewards = fig.add_axes((0, 0.6, 1, 0.1), sharex=ax_rewards_bar)
-                    ax_rewards_line = fig.add_axes((0, 0.4, 1, 0.2), sharex=ax_cummulated_rewards)
-
-                    rewards_df_only_values = rewards_df[asset].dropna()
-                    rewards_df_only_values_base_currency = rewards_df[asset + appendix].dropna()
-                    ax_rewards_bar.bar(rewards_df_only_values.index, rewards_df_only_values.astype(float),
-                                   alpha=0.5, label=asset)
-                    ax_rewards_line.plot(rewards_df_only_values_base_currency.index, rewards_df_only_values_base_currency.astype(float),
-                                   alpha=0.5, label=asset + appendix, marker='.')
-                    ax_rewards_line.yaxis.set_major_locator(plt.MaxNLocator(nbins=5, integer=True))
-
-                    ax_rewards_bar.legend(loc='best', fontsize='small', frameon=True, fancybox=True)
-                    ax_rewards_bar.get_legend().set_title("Rewards")
-                    ax_rewards_bar.set_ylabel(asset.rstrip('.S'), size=4)
-
-                    ax_rewards_line.legend(loc='best', fontsize='small', frameon=True, fancybox=True)
-                    ax_rewards_line.get_legend().set_title("Rewards in base currency")
-                    ax_rewards_line.set_ylabel(base_currency, size=4)
-
-                    ax_cummulated_rewards_base_currency = fig.add_axes((0, 0.0, 1, 0.4), sharex=ax_rewards_line)
-                    # Format x-axis ticks as dates
-                    ax_cummulated_rewards.xaxis_date()
-                    ax_cummulated_rewards_base_currency.xaxis_date()
-                    accumulated_rewards_df_only_values = df_accumulated[asset].dropna()
-                    # for comparison: Accumulated value of rewards on time of receive
-                    rewards_df_only_values_base_currency_accumulated = rewards_df[asset + "_" + base_currency + "_ONREC"].dropna()
-                    df_accumulated_base_currency = df_accumulated[asset + appendix  + "_ACC"].dropna()
-                    # calculate difference between value of accumulated rewards and gain on continuous sale of rewards:
-                    difference_df = df_accumulated_base_currency.astype(float) - rewards_df_only_values_base_currency_accumulated.astype(float)
-                    ax_cummulated_rewards.plot(accumulated_rewards_df_only_values.index, accumulated_rewards_df_only_values.astype(float),
-                                       alpha=0.5, label=asset, marker='.')
-                    ax_cummulated_rewards_base_currency.plot(df_accumulated_base_currency.index, df_accumulated_base_currency.astype(float),
-                                       alpha=0.5, label=asset + appendix + "_ACC", marker='.')
-                    ax_cummulated_rewards_base_currency.plot(rewards_df_only_values_base_currency_accumulated.index, rewards_df_only_values_base_currency_accumulated.astype(float),
-                                   alpha=0.5, label=asset + "_" + base_currency + "_ONSALE", marker='.')
-                    ax_cummulated_rewards_base_currency.axhline(y=0, color='grey', alpha=0.5, linestyle='-')
-                    ax_cummulated_rewards_base_currency.plot(difference_df.index, difference_df.astype(float),
-                                   alpha=0.5, label="DIFFERENCE", color='grey')
-
-                    ax_cummulated_rewards_base_currency.fill_between(difference_df.index, difference_df, 0, where=(difference_df >= 0), color='g', alpha=0.3)
-                    ax_cummulated_rewards_base_currency.fill_between(difference_df.index, difference_df, 0, where=(difference_df <= 0), color='r', alpha=0.3)
-
-
-                    ax_cummulated_rewards_base_currency.yaxis.set_major_locator(plt.MaxNLocator(nbins=10, integer=True))
-                    ax_cummulated_rewards.legend(loc='best', fontsize='small', frameon=True, fancybox=True)
-                    ax_cummulated_rewards.get_legend().set_title("Rewards accumulated")
-                    ax_cummulated_rewards.set_ylabel(asset.rstrip('.S'), size=4)
-                    ax_cummulated_rewards_base_currency.legend(loc='best', fontsize='small', frameon=True, fancybox=True)
-                    ax_cummulated_rewards_base_currency.get_legend().set_title("Value on continuous sale vs. on timestamp")
-                    ax_cummulated_rewards_base_currency.set_ylabel(base_currency, size=4)
-
-                    st.pyplot(fig)
-                    summary_df = pd.concat([rewards_df_only_values, rewards_df_only_values_base_currency, rewards_df_only_values_base_currency_accumulated], axis=1)
-
-                    fig_canvas = FigureCanvas(fig)
-                    buf = io.BytesIO()
-                    fig_canvas.print_png(buf)
-                    fig_data = base64.b64encode(buf.getbuffer()).decode("utf8")
-                    html_fig = f"""<img style="padding: 0px; margin: 0px;" src="data:image/png;base64,{fig_data}" width="900">"""
-                    html_summary_df = summary_df.to_html()
-                    html_body_str = html_body_str + html_subheader_txt + html_fig + html_summary_df + html_short_asset_stats_txt
+
+                    st.image(chart_image)
+                    summary_df = charts.summary_table(chart_data)
                     st.dataframe(summary_df)
-                    #st.dataframe(rewards_df_only_values)
-                    #st.dataframe(rewards_df_only_values_base_currency)
-                    #st.dataframe(df_accumulated_base_currency)
-
-            html = f"""
-            <html>
-                <head>
-                    <meta http-equiv="Content-Type" content="text/html; charset=utf-8">
-                    <title>Kraken Staking Report</title>
-                </head>
-                <body>
-                    {html_body_str}
-                </body>
-            </html>
-            """
-
-            print(html)
-
-            pdfkit.from_string(html, 'report.pdf')
+                    report_sections.append(pdf_export.report_section(str(i) + "  " + str(asset), chart_image,
+                                                                     summary_df, total_text_str))
+
+            # the pdf is only generated on demand, unchanged reports are served from memory:
+            st.subheader("PDF report")
+            report_charts = st.radio('Report charts', ('as shown', 'downscaled', 'vector'), horizontal=True)
+            if st.checkbox("Create PDF report"):
+                if report_charts != 'as shown':
+                    dpi, fmt = (72, 'png') if report_charts == 'downscaled' else (charts.default_dpi, 'svg')
+                    for section, chart_image in zip(report_sections,
+                                                    charts.render_charts(asset_charts, dpi=dpi, fmt=fmt)):
+                        section['image'], section['image_format'] = chart_image, fmt
+                with st.spinner('Generating report ...'):
+                    try:
+                        with instrumentation.stage('pdf_export'):
+                            report_pdf = pdf_export.generate_report(report_sections)
+                    except OSError as e:
+                        st.warning(f"PDF report could not be generated, is wkhtmltopdf installed? {e}")
+                        st.stop()
+                st.download_button("Download PDF report", report_pdf, file_name='report.pdf',
+                                   mime='application/pdf')
+
+
+def update_status(database_updater, ticker_list, start_date):
+    """
+    Shows the progress of the background update of the tickers, or its result once it finished.
+    :param database_updater: updater.Updater
+    :param ticker_list: list of str
+    :param start_date: datetime.date the update was requested from
+    """
+    statuses = database_updater.status(ticker_list)
+    if database_updater.active(ticker_list):
+        progress = sum(status['progress'] for status in statuses.values()) / max(len(statuses), 1)
+        st.progress(progress)
+        st.text(f"Receiving data ... about {database_updater.eta(ticker_list):.0f} s left. " +
+                ", ".join(f"{ticker}: {status['state']}" for ticker, status in statuses.items()))
+        return
+    updated = [ticker for ticker, status in statuses.items() if status['state'] == 'done']
+    st.success("Updated: " + str(updated) + " from last: " + str(start_date))
+    for ticker, status in statuses.items():
+        if status['state'] == 'failed':
+            st.warning(f"Update of {ticker} failed: {status['error']}")
+    # the result is shown once:
+    st.session_state['update_tickers'] = None
+
+
+def diagnostics_panel(render_metrics):
+    """
+    Shows the stage timings, query and request statistics and the memory of the last rerun.
+    :param render_metrics: instrumentation.Metrics
+    """
+    snapshot = render_metrics.snapshot()
+    with st.expander("Diagnostics", expanded=True):
+        st.text("Stages (seconds, peak memory of the process with STAKING_REWARDS_TRACE_MEMORY=1):")
+        st.dataframe(pd.DataFrame.from_dict(snapshot['stages'], orient='index'))
+        st.text("Counters:")
+        st.dataframe(pd.Series(snapshot['counters'], name='count', dtype='int64'))
+        st.text("Latency histograms of SQL statements and HTTP requests:")
+        st.dataframe(pd.DataFrame({name: {'count': histogram['count'], 'seconds': histogram['seconds'],
+                                          **histogram['buckets']}
+                                   for name, histogram in snapshot['histograms'].items()}).T)
+        if snapshot['max_rss_bytes'] is not None:
+            st.text(f"Peak memory of the process: {snapshot['max_rss_bytes'] / 1024 ** 2:.1f} MB")
 
 
+def main():
+    # Layout setup:
+    st.set_page_config(page_title="Kraken Staking Calculator", page_icon=":chart_with_upwards_trend:", layout="wide")
+    st.title("Kraken Staking Calculator")
+    show_diagnostics = st.sidebar.checkbox("Show diagnostics")
+
+    with instrumentation.capture() as render_metrics:
+        try:
+            with instrumentation.stage('render'):
+                render_page()
+        # st.stop() ends the page early, e.g. while it waits for the database update:
+        except StopException:
+            pass
+        finally:
+            # also after an error of the page:
+            instrumentation.log_event({'event': 'render', **render_metrics.snapshot()})
+            if show_diagnostics:
+                diagnostics_panel(render_metrics)
+
+    # only reached if the page rendered, a rerun raised in finally would hide its errors.
+    # rerun until the background update of the session finished, new rows are picked up on every rerun:
+    update_tickers = st.session_state.get('update_tickers')
+    if update_tickers and updater.get_updater().active(update_tickers):
+        time.sleep(update_refresh_seconds)
+        st.experimental_rerun()
+
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,153 @@
+"""
+Processes a directory of kraken ledger CSVs without Streamlit, one account per ledger file.
+
+Example:
+    python batch.py ledgers/ reports/ --base-currency EUR --update --workers 8
+
+For every ledger <account>.csv the directory reports/<account>/ receives rewards.csv, accumulated.csv and
+summary.csv, reports/summary.csv collects the summaries of all accounts.
+"""
+import argparse
+import concurrent.futures
+import datetime
+import multiprocessing
+import pathlib
+import sys
+import pandas as pd
+import data_requests as data_requests
+import ledger as ledger
+import ledger_cache as ledger_cache
+import valuation as valuation
+
+
+def init_worker(db_url, cache_dir):
+    data_requests.use_database(db_url)
+    ledger_cache.cache_dir = cache_dir
+
+
+def load_rewards(ledger_path):
+    """
+    :param ledger_path: pathlib.Path of a kraken ledger csv
+    :return: pd.DataFrame as returned by ledger.pivot_rewards, cached by file content
+    """
+    ledger_hash = ledger_cache.file_hash(ledger_path)
+    parsed_frames = ledger_cache.load_frames(ledger_hash, ['rewards', 'staking'])
+    if parsed_frames is not None:
+        return parsed_frames['rewards']
+    rewards_df, staking_df = ledger.read_rewards(ledger_path)
+    ledger_cache.store_frames(ledger_hash, {'rewards': rewards_df, 'staking': staking_df})
+    return rewards_df
+
+
+def process_ledger(ledger_path, output_dir, base_currency, day_price, start_date, end_date):
+    """
+    Computes the rewards, accumulated and summary tables of one account and writes them as csv.
+    :param ledger_path: pathlib.Path of a kraken ledger csv
+    :param output_dir: pathlib.Path, the tables are written to output_dir/<ledger stem>/
+    :param base_currency: str ('EUR', 'USD')
+    :param day_price: str ('close', 'low', 'high')
+    :param start_date: datetime.date
+    :param end_date: datetime.date
+    :return: pd.DataFrame, the summary of the account
+    """
+    rewards_df = ledger.select_period(load_rewards(ledger_path), start_date, end_date)
+    reward_assets = ledger.get_reward_assets(rewards_df)
+    rewards_df, df_accumulated = valuation.value_rewards(rewards_df, reward_assets, base_currency, day_price)
+    summary_df = valuation.summarize_rewards(rewards_df, df_accumulated, reward_assets, base_currency)
+
+    account_dir = pathlib.Path.joinpath(output_dir, ledger_path.stem)
+    account_dir.mkdir(parents=True, exist_ok=True)
+    rewards_df.to_csv(pathlib.Path.joinpath(account_dir, 'rewards.csv'))
+    df_accumulated.to_csv(pathlib.Path.joinpath(account_dir, 'accumulated.csv'))
+    summary_df.to_csv(pathlib.Path.joinpath(account_dir, 'summary.csv'))
+    return summary_df
+
+
+def update_prices(ledger_paths, base_currency, start_date):
+    """
+    Syncs the prices of all reward assets of all ledgers once, before the accounts are processed.
+    Ledgers that cannot be read are reported on stderr and skipped.
+    :return: dict as returned by valuation.sync_prices, list of the skipped ledger paths
+    """
+    reward_assets = set()
+    skipped = []
+    for ledger_path in ledger_paths:
+        try:
+            rewards_df = load_rewards(ledger_path)
+        except ledger.LedgerFormatError as e:
+            print(f"{ledger_path.name}: {e}", file=sys.stderr)
+            skipped.append(ledger_path)
+            continue
+        reward_assets.update(ledger.get_reward_assets(rewards_df))
+    start = int(datetime.datetime.combine(start_date - datetime.timedelta(days=1), datetime.time(),
+                                          tzinfo=datetime.timezone.utc).timestamp())
+    return valuation.sync_prices(sorted(reward_assets), base_currency, start), skipped
+
+
+def parse_args(argv=None):
+    end_date = datetime.date.today()
+    parser = argparse.ArgumentParser(description="Calculate kraken staking rewards of many ledgers.")
+    parser.add_argument('ledger_dir', type=pathlib.Path, help="directory of kraken ledger csv files")
+    parser.add_argument('output_dir', type=pathlib.Path, help="directory the tables are written to")
+    parser.add_argument('--base-currency', default='EUR', choices=('EUR', 'USD'))
+    parser.add_argument('--day-price', default='close', choices=('close', 'low', 'high'),
+                        help="daily price the rewards are valued at")
+    parser.add_argument('--start-date', type=datetime.date.fromisoformat,
+                        default=end_date - datetime.timedelta(days=650), help="YYYY-MM-DD")
+    parser.add_argument('--end-date', type=datetime.date.fromisoformat, default=end_date, help="YYYY-MM-DD")
+    parser.add_argument('--update', action='store_true', help="update the exchange database first")
+    parser.add_argument('--workers', type=int, default=None, help="number of processes, defaults to the cpu count")
+    parser.add_argument('--database', type=pathlib.Path, default=None,
+                        help="sqlite price database, defaults to " + data_requests.db_name)
+    parser.add_argument('--cache-dir', type=pathlib.Path, default=ledger_cache.cache_dir,
+                        help="directory of the parsed ledger cache")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    db_url = data_requests.db_path if args.database is None else 'sqlite:///' + str(args.database.resolve())
+    init_worker(db_url, args.cache_dir)
+    ledger_paths = sorted(args.ledger_dir.glob('*.csv'))
+    if not ledger_paths:
+        print(f"No ledger csv files found in {args.ledger_dir}", file=sys.stderr)
+        return 1
+
+    summaries = {}
+    failed = 0
+    if args.update:
+        report, skipped = update_prices(ledger_paths, args.base_currency, args.start_date)
+        for ticker, result in report.items():
+            if 'error' in result:
+                print(f"Update of {ticker} failed: {result['error']}", file=sys.stderr)
+        # already reported, the accounts would fail again:
+        failed += len(skipped)
+        ledger_paths = [ledger_path for ledger_path in ledger_paths if ledger_path not in skipped]
+    # spawn: every worker opens its own database connection instead of inheriting the parent's
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.workers,
+                                                mp_context=multiprocessing.get_context('spawn'),
+                                                initializer=init_worker,
+                                                initargs=(db_url, args.cache_dir)) as executor:
+        futures = {executor.submit(process_ledger, ledger_path, args.output_dir, args.base_currency, args.day_price,
+                                   args.start_date, args.end_date): ledger_path for ledger_path in ledger_paths}
+        for future in concurrent.futures.as_completed(futures):
+            ledger_path = futures[future]
+            try:
+                summaries[ledger_path.stem] = future.result()
+            except data_requests.MissingPriceError as e:
+                failed += 1
+                print(f"{ledger_path.name}: {e}. Database out of date, run with --update.", file=sys.stderr)
+            except ledger.LedgerFormatError as e:
+                failed += 1
+                print(f"{ledger_path.name}: {e}", file=sys.stderr)
+            else:
+                print(f"{ledger_path.name}: done")
+
+    if summaries:
+        summary_df = pd.concat(summaries, names=['account'])
+        summary_df.sort_index().to_csv(pathlib.Path.joinpath(args.output_dir, 'summary.csv'))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
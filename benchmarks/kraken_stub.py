@@ -0,0 +1,128 @@
+"""
+Local stand-in for kraken's public /0/public/OHLC endpoint, used by the benchmarks and the offline tests.
+
+Example:
+    server = KrakenStubServer(bars_start=1640995200, bars_end=1672531200).start()
+    with connect(server, 'sqlite:///prices.db'):
+        data_requests.add_ohlc('SOLEUR', 1672012800)
+"""
+import contextlib
+import http.server
+import json
+import math
+import threading
+import urllib.parse
+import zlib
+import data_requests as data_requests
+
+
+def bar_price(pair, timestamp):
+    """
+    :return: float, deterministic synthetic close price of pair at timestamp
+    """
+    base = 1 + zlib.crc32(pair.encode()) % 100
+    return base * (1 + 0.2 * math.sin(timestamp / 86400 / 29))
+
+
+class KrakenOHLCHandler(http.server.BaseHTTPRequestHandler):
+    """Answers like kraken: at most page_size bars after since, last is the newest committed bar."""
+
+    def do_GET(self):
+        server = self.server
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+        pair = query['pair'][0]
+        since = int(query.get('since', [0])[0])
+        interval = int(query.get('interval', [1])[0])
+        with server.lock:
+            server.requests.append((pair, since))
+            rate_limited = server.rate_limited > 0
+            if rate_limited:
+                server.rate_limited -= 1
+        if rate_limited:
+            self.send_json({'error': ['EAPI:Rate limit exceeded']})
+            return
+        if pair in server.unknown_pairs:
+            self.send_json({'error': ['EQuery:Unknown asset pair']})
+            return
+        step = interval * 60
+        first = max(server.bars_start, since + 1)
+        # bars start at multiples of the interval:
+        first = first + (-first % step)
+        timestamps = range(first, server.bars_end + 1, step)[:server.page_size]
+        bars = []
+        for timestamp in timestamps:
+            close = bar_price(pair, timestamp)
+            bars.append([timestamp, f'{close * 0.99:.4f}', f'{close * 1.02:.4f}', f'{close * 0.97:.4f}',
+                         f'{close:.4f}', f'{close:.4f}', '10.0', 5])
+        # the newest bar is still open:
+        last = timestamps[-2] if len(timestamps) > 1 else since
+        self.send_json({'error': [], 'result': {'X' + pair: bars, 'last': last}})
+
+    def send_json(self, data):
+        body = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class KrakenStubServer(http.server.ThreadingHTTPServer):
+    """
+    :param bars_start: linux timestamp of the first bar served
+    :param bars_end: linux timestamp of the last (open) bar served
+    :param page_size: max bars per response, kraken serves 720
+    """
+    daemon_threads = True
+
+    def __init__(self, bars_start, bars_end, page_size=720):
+        super().__init__(('127.0.0.1', 0), KrakenOHLCHandler)
+        self.bars_start = bars_start
+        self.initial_bars_end = bars_end
+        self.initial_page_size = page_size
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        Restores the bars of the constructor and clears the recorded requests.
+        """
+        self.bars_end = self.initial_bars_end
+        self.page_size = self.initial_page_size
+        # (pair, since) of every request:
+        self.requests = []
+        # number of requests to answer with a rate limit error before serving data:
+        self.rate_limited = 0
+        # pairs kraken does not list:
+        self.unknown_pairs = set()
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}/0/public/OHLC'
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+@contextlib.contextmanager
+def connect(server, db_url):
+    """
+    Points data_requests to the stub, without a rate limit, and to the database db_url while the block runs,
+    the server is reset first.
+    :param server: KrakenStubServer
+    :param db_url: sqlalchemy database url, e.g. of a temporary file
+    """
+    server.reset()
+    kraken_ohlc_url, rate_limiter = data_requests.kraken_ohlc_url, data_requests.rate_limiter
+    data_requests.kraken_ohlc_url = server.url
+    data_requests.rate_limiter = data_requests.TokenBucket(rate=1000, capacity=1000)
+    data_requests.use_database(db_url)
+    try:
+        yield server
+    finally:
+        data_requests.kraken_ohlc_url, data_requests.rate_limiter = kraken_ohlc_url, rate_limiter
+        data_requests.use_database(data_requests.db_path)
@@ -0,0 +1,194 @@
+"""
+Times ledger ingestion, exchange database sync, valuation, chart rendering and pdf export on a synthetic
+ledger, offline against a local stand-in of the kraken OHLC endpoint, and writes the results as JSON.
+
+Example:
+    python -m benchmarks.run --assets 8 --days 700 --rewards-per-day 4 --noise-rows 20 --output results.json
+
+Every stage is run --repeat times, its caches are cleared before every run unless the stage name says warm.
+Peak memory is measured in one additional run with tracemalloc, so tracing does not distort the timings.
+Memory of the chart worker processes is not included.
+"""
+import argparse
+import datetime
+import json
+import pathlib
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import pandas as pd
+import data_requests as data_requests
+import ledger as ledger
+import ledger_cache as ledger_cache
+import instrumentation as instrumentation
+import valuation as valuation
+import charts as charts
+import pdf_export as pdf_export
+from benchmarks import synthetic
+from benchmarks.kraken_stub import KrakenStubServer
+
+
+def measure(run, repeat=3, setup=None, memory=True):
+    """
+    :param run: callable() -> int, the number of items processed
+    :param repeat: int, number of timed runs
+    :param setup: callable() called untimed before every run, e.g. to clear caches
+    :param memory: False to skip the traced run
+    :return: dict of the timings, the throughput, the SQL and HTTP counters of one run and the peak memory of the stage
+    """
+    seconds = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        with instrumentation.capture() as run_metrics:
+            start = time.perf_counter()
+            items = run()
+            seconds.append(time.perf_counter() - start)
+    result = {'items': items, 'seconds_min': min(seconds), 'seconds_median': statistics.median(seconds),
+              'items_per_second': items / min(seconds) if min(seconds) > 0 else None,
+              'counters': run_metrics.snapshot()['counters']}
+    if memory:
+        if setup is not None:
+            setup()
+        tracemalloc.start()
+        try:
+            run()
+            result['peak_memory_bytes'] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the staking rewards pipeline on a synthetic ledger.")
+    synthetic.add_ledger_arguments(parser)
+    parser.add_argument('--base-currency', default='EUR', choices=('EUR', 'USD'))
+    parser.add_argument('--repeat', type=int, default=3, help="timed runs per stage")
+    parser.add_argument('--no-memory', action='store_true', help="skip the peak memory measurement")
+    parser.add_argument('--serial-charts', action='store_true', help="render the charts in this process")
+    parser.add_argument('--output', type=pathlib.Path, default=None, help="JSON file, defaults to stdout")
+    return parser.parse_args(argv)
+
+
+def run_benchmarks(args, work_dir):
+    """
+    :param args: argparse.Namespace as returned by parse_args
+    :param work_dir: pathlib.Path of an empty directory for the ledger, the database and the caches
+    :return: dict name -> result of measure
+    """
+    memory = not args.no_memory
+    end_date = datetime.date.today()
+    ledger_path = pathlib.Path.joinpath(work_dir, 'ledger.csv')
+    ledger_df = synthetic.write_ledger(ledger_path, end_date=end_date, **synthetic.ledger_arguments(args))
+    ledger_cache.cache_dir = pathlib.Path.joinpath(work_dir, 'ledger_cache')
+    stages = {}
+
+    stages['ingestion'] = measure(lambda: ledger.read_rewards(ledger_path) and len(ledger_df),
+                                  args.repeat, memory=memory)
+    rewards_df, staking_df = ledger.read_rewards(ledger_path)
+    ledger_hash = ledger_cache.file_hash(ledger_path)
+    ledger_cache.store_frames(ledger_hash, {'rewards': rewards_df, 'staking': staking_df})
+    stages['ingestion_cached'] = measure(lambda: ledger_cache.load_frames(ledger_hash, ['rewards', 'staking'])
+                                         and len(ledger_df), args.repeat, memory=memory)
+
+    reward_assets = ledger.get_reward_assets(rewards_df)
+    ticker_list = valuation.sync_tickers(reward_assets, args.base_currency)
+    start_date = end_date - datetime.timedelta(days=args.days - 1)
+    start = int(datetime.datetime.combine(start_date - datetime.timedelta(days=1), datetime.time(),
+                                          tzinfo=datetime.timezone.utc).timestamp())
+    server = KrakenStubServer(bars_start=start, bars_end=start + (args.days + 1) * 86400).start()
+    kraken_ohlc_url, rate_limiter = data_requests.kraken_ohlc_url, data_requests.rate_limiter
+    data_requests.kraken_ohlc_url = server.url
+    # the stub has no rate limit, the benchmark measures the client and the database:
+    data_requests.rate_limiter = data_requests.TokenBucket(10000, 10000)
+    databases = iter(range(args.repeat + 2))
+
+    def new_database():
+        db_file = pathlib.Path.joinpath(work_dir, f'HLOCV_{next(databases)}.db')
+        data_requests.use_database('sqlite:///' + str(db_file))
+
+    def sync():
+        report = data_requests.sync_list_of_ohlc(ticker_list, start)
+        errors = {ticker: result['error'] for ticker, result in report.items() if 'error' in result}
+        if errors:
+            raise RuntimeError(f"Sync against the stub failed: {errors}")
+        return sum(result['bars'] for result in report.values())
+
+    try:
+        server.requests = []
+        stages['db_sync'] = measure(sync, args.repeat, setup=new_database, memory=memory)
+        stages['db_sync']['requests'] = len(server.requests)
+        # the database of the last run stays in use for the following stages:
+        stages['db_sync_incremental'] = measure(sync, args.repeat, memory=memory)
+    finally:
+        server.shutdown()
+        server.server_close()
+        data_requests.kraken_ohlc_url, data_requests.rate_limiter = kraken_ohlc_url, rate_limiter
+
+    period_df = ledger.select_period(rewards_df, start_date, end_date)
+    reward_count = int(period_df[reward_assets].count().sum())
+
+    def value():
+        valuation.value_rewards(period_df, reward_assets, args.base_currency)
+        return reward_count
+
+    stages['valuation'] = measure(value, args.repeat, setup=data_requests.price_cache.invalidate, memory=memory)
+    stages['valuation_warm'] = measure(value, args.repeat, memory=memory)
+
+    valued_df, df_accumulated = valuation.value_rewards(period_df, reward_assets, args.base_currency)
+    asset_charts = [(asset, args.base_currency,
+                     charts.asset_chart_data(valued_df, df_accumulated, asset, args.base_currency))
+                    for asset in reward_assets]
+
+    def render():
+        return len(charts.render_charts(asset_charts, parallel=not args.serial_charts))
+
+    stages['charts'] = measure(render, args.repeat, setup=charts.chart_cache.clear, memory=memory)
+    stages['charts_warm'] = measure(render, args.repeat, memory=memory)
+
+    summary_df = valuation.summarize_rewards(valued_df, df_accumulated, reward_assets, args.base_currency)
+    report_sections = [pdf_export.report_section(asset, chart_image, charts.summary_table(chart_data),
+                                                 str(summary_df.loc[asset].to_dict()))
+                       for (asset, _, chart_data), chart_image in zip(asset_charts, charts.render_charts(asset_charts))]
+
+    def build_html():
+        with tempfile.TemporaryDirectory() as image_dir:
+            pdf_export.build_report_html(report_sections, pathlib.Path(image_dir))
+        return len(report_sections)
+
+    stages['pdf_html'] = measure(build_html, args.repeat, memory=memory)
+    if shutil.which('wkhtmltopdf') is None:
+        stages['pdf_export'] = {'skipped': "wkhtmltopdf not found"}
+    else:
+        stages['pdf_export'] = measure(lambda: pdf_export.generate_report(report_sections) and len(report_sections),
+                                       args.repeat, setup=pdf_export.report_cache.clear, memory=memory)
+    return stages
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    with tempfile.TemporaryDirectory() as work_dir:
+        stages = run_benchmarks(args, pathlib.Path(work_dir))
+    results = {
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'platform': platform.platform(),
+        'parameters': vars(args) | {'output': None if args.output is None else str(args.output)},
+        'stages': stages,
+        'max_rss_bytes': instrumentation.max_rss_bytes(),
+    }
+    output = json.dumps(results, indent=2)
+    if args.output is None:
+        print(output)
+    else:
+        args.output.write_text(output + '\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
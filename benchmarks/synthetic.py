@@ -0,0 +1,105 @@
+"""
+Generates synthetic kraken ledger exports for the benchmarks.
+
+Example:
+    python -m benchmarks.synthetic ledger.csv --assets 8 --days 700 --rewards-per-day 4 --noise-rows 20
+"""
+import argparse
+import datetime
+import pathlib
+import numpy as np
+import pandas as pd
+import ledger as ledger
+
+# staking assets named like kraken does, further assets get generated names:
+asset_names = ['DOT', 'SOL', 'ADA', 'ETH2', 'KSM', 'ATOM', 'FLOW', 'MINA', 'KAVA', 'SCRT', 'XTZ', 'TRX']
+noise_types = ['trade', 'deposit', 'withdrawal', 'spend', 'receive', 'transfer']
+noise_assets = ['ZEUR', 'ZUSD', 'XXBT', 'XETH', 'USDT']
+
+
+def staking_assets(count):
+    """
+    :param count: int
+    :return: list of str (['DOT.S', 'SOL.S', ...])
+    """
+    names = asset_names[:count] + [f'AS{i}' for i in range(count - len(asset_names))]
+    return [name + '.S' for name in names]
+
+
+def make_ledger(assets=4, days=365, rewards_per_day=1, noise_rows_per_day=0, end_date=None, seed=0):
+    """
+    :param assets: int, number of staking assets
+    :param days: int, number of days with rewards, ending at end_date
+    :param rewards_per_day: int, rewards per asset and day
+    :param noise_rows_per_day: int, non staking rows (trades, deposits, ...) per day
+    :param end_date: datetime.date of the last day, defaults to today
+    :param seed: int, the same arguments always give the same ledger
+    :return: pd.DataFrame with the columns of a kraken ledger export, sorted by time
+    """
+    if end_date is None:
+        end_date = datetime.date.today()
+    rng = np.random.default_rng(seed)
+    first_day = np.datetime64(end_date - datetime.timedelta(days=days - 1), 's')
+    day_offsets = np.arange(days) * 86400
+
+    asset_list = staking_assets(assets)
+    reward_count = days * rewards_per_day * len(asset_list)
+    reward_times = (np.repeat(day_offsets, rewards_per_day * len(asset_list))
+                    + rng.integers(0, 86400, reward_count))
+    reward_assets = np.tile(np.repeat(asset_list, rewards_per_day), days)
+    reward_amounts = rng.uniform(0.0001, 0.1, reward_count)
+
+    noise_count = days * noise_rows_per_day
+    noise_times = np.repeat(day_offsets, noise_rows_per_day) + rng.integers(0, 86400, noise_count)
+
+    ledger_df = pd.DataFrame({
+        'time': first_day + np.concatenate([reward_times, noise_times]).astype('timedelta64[s]'),
+        'type': np.concatenate([np.full(reward_count, 'staking'), rng.choice(noise_types, noise_count)]),
+        'subtype': '',
+        'aclass': 'currency',
+        'asset': np.concatenate([reward_assets, rng.choice(noise_assets, noise_count)]),
+        'amount': np.concatenate([reward_amounts, rng.uniform(-100, 100, noise_count)]),
+        'fee': 0.0})
+    ledger_df = ledger_df.sort_values('time', kind='stable', ignore_index=True)
+    ledger_df['balance'] = ledger_df.groupby('asset')['amount'].cumsum()
+    ledger_df.insert(0, 'txid', [f'L{i:09d}' for i in range(len(ledger_df))])
+    ledger_df.insert(1, 'refid', [f'R{i:09d}' for i in range(len(ledger_df))])
+    return ledger_df[ledger.required_columns]
+
+
+def write_ledger(path, **kwargs):
+    """
+    Writes a synthetic ledger like kraken exports it.
+    :param path: path of the csv
+    :param kwargs: arguments of make_ledger
+    :return: pd.DataFrame, the written ledger
+    """
+    ledger_df = make_ledger(**kwargs)
+    ledger_df.to_csv(path, index=False, float_format='%.10f', date_format='%Y-%m-%d %H:%M:%S')
+    return ledger_df
+
+
+def add_ledger_arguments(parser):
+    parser.add_argument('--assets', type=int, default=4, help="number of staking assets")
+    parser.add_argument('--days', type=int, default=365, help="number of days with rewards")
+    parser.add_argument('--rewards-per-day', type=int, default=1, help="rewards per asset and day")
+    parser.add_argument('--noise-rows', type=int, default=0, help="non staking rows per day")
+    parser.add_argument('--seed', type=int, default=0)
+
+
+def ledger_arguments(args):
+    return {'assets': args.assets, 'days': args.days, 'rewards_per_day': args.rewards_per_day,
+            'noise_rows_per_day': args.noise_rows, 'seed': args.seed}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write a synthetic kraken ledger csv.")
+    parser.add_argument('path', type=pathlib.Path)
+    add_ledger_arguments(parser)
+    args = parser.parse_args(argv)
+    ledger_df = write_ledger(args.path, **ledger_arguments(args))
+    print(f"{args.path}: {len(ledger_df)} rows")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+import collections
+import concurrent.futures
+import hashlib
+import io
+import multiprocessing
+import threading
+import matplotlib
+from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
+from matplotlib.figure import Figure
+from matplotlib.ticker import MaxNLocator
+import pandas as pd
+
+# rendered charts kept in memory, keyed by chart_key:
+max_cached_charts = 128
+# below this number of charts to render, starting worker processes costs more than it saves:
+parallel_threshold = 4
+default_dpi = 150
+
+chart_cache = collections.OrderedDict()
+chart_cache_lock = threading.Lock()
+executor = None
+executor_lock = threading.Lock()
+
+
+def asset_chart_data(rewards_df, df_accumulated, asset, base_currency):
+    """
+    :param rewards_df: pd.DataFrame as returned by valuation.value_rewards
+    :param df_accumulated: pd.DataFrame as returned by valuation.value_rewards
+    :param asset: str (SOL.S)
+    :param base_currency: str ('EUR', 'USD')
+    :return: dict of pd.Series (without NaN) the charts and the summary table of the asset are built from
+    """
+    appendix = '_' + base_currency
+    return {'rewards': rewards_df[asset].dropna(),
+            'rewards_base_currency': rewards_df[asset + appendix].dropna().astype(float),
+            'accumulated': df_accumulated[asset].dropna(),
+            'accumulated_base_currency': df_accumulated[asset + appendix + '_ACC'].dropna().astype(float),
+            # for comparison: Accumulated value of rewards on time of receive
+            'on_receipt_base_currency': rewards_df[asset + appendix + '_ONREC'].dropna().astype(float)}
+
+
+def summary_table(chart_data):
+    """
+    :param chart_data: dict as returned by asset_chart_data
+    :return: pd.DataFrame with reward, reward in base currency and accumulated value on receipt per timestamp
+    """
+    return pd.concat([chart_data['rewards'], chart_data['rewards_base_currency'],
+                      chart_data['on_receipt_base_currency']], axis=1)
+
+
+def plot_asset(fig, asset, base_currency, chart_data):
+    """
+    Draws the reward, accumulated reward and value charts of one asset on five stacked axes.
+    :param fig: matplotlib.figure.Figure
+    :param asset: str (SOL.S)
+    :param base_currency: str ('EUR', 'USD')
+    :param chart_data: dict as returned by asset_chart_data
+    """
+    appendix = '_' + base_currency
+    ax_rewards_bar = fig.add_axes((0, 0.7, 1, 0.1))
+    ax_cummulated_rewards = fig.add_axes((0, 0.6, 1, 0.1), sharex=ax_rewards_bar)
+    ax_rewards_line = fig.add_axes((0, 0.4, 1, 0.2), sharex=ax_cummulated_rewards)
+
+    rewards = chart_data['rewards']
+    rewards_base_currency = chart_data['rewards_base_currency']
+    ax_rewards_bar.bar(rewards.index, rewards.astype(float), alpha=0.5, label=asset)
+    ax_rewards_line.plot(rewards_base_currency.index, rewards_base_currency, alpha=0.5, label=asset + appendix,
+                         marker='.')
+    ax_rewards_line.yaxis.set_major_locator(MaxNLocator(nbins=5, integer=True))
+
+    ax_rewards_bar.legend(loc='best', fontsize='small', frameon=True, fancybox=True)
+    ax_rewards_bar.get_legend().set_title("Rewards")
+    ax_rewards_bar.set_ylabel(asset.rstrip('.S'), size=4)
+
+    ax_rewards_line.legend(loc='best', fontsize='small', frameon=True, fancybox=True)
+    ax_rewards_line.get_legend().set_title("Rewards in base currency")
+    ax_rewards_line.set_ylabel(base_currency, size=4)
+
+    ax_cummulated_rewards_base_currency = fig.add_axes((0, 0.0, 1, 0.4), sharex=ax_rewards_line)
+    # Format x-axis ticks as dates
+    ax_cummulated_rewards.xaxis_date()
+    ax_cummulated_rewards_base_currency.xaxis_date()
+    accumulated = chart_data['accumulated']
+    accumulated_base_currency = chart_data['accumulated_base_currency']
+    on_receipt_base_currency = chart_data['on_receipt_base_currency']
+    # calculate difference between value of accumulated rewards and gain on continuous sale of rewards:
+    difference_df = accumulated_base_currency - on_receipt_base_currency
+    ax_cummulated_rewards.plot(accumulated.index, accumulated.astype(float), alpha=0.5, label=asset, marker='.')
+    ax_cummulated_rewards_base_currency.plot(accumulated_base_currency.index, accumulated_base_currency,
+                                             alpha=0.5, label=asset + appendix + "_ACC", marker='.')
+    ax_cummulated_rewards_base_currency.plot(on_receipt_base_currency.index, on_receipt_base_currency,
+                                             alpha=0.5, label=asset + appendix + "_ONSALE", marker='.')
+    ax_cummulated_rewards_base_currency.axhline(y=0, color='grey', alpha=0.5, linestyle='-')
+    ax_cummulated_rewards_base_currency.plot(difference_df.index, difference_df, alpha=0.5, label="DIFFERENCE",
+                                             color='grey')
+
+    ax_cummulated_rewards_base_currency.fill_between(difference_df.index, difference_df, 0,
+                                                     where=(difference_df >= 0), color='g', alpha=0.3)
+    ax_cummulated_rewards_base_currency.fill_between(difference_df.index, difference_df, 0,
+                                                     where=(difference_df <= 0), color='r', alpha=0.3)
+
+    ax_cummulated_rewards_base_currency.yaxis.set_major_locator(MaxNLocator(nbins=10, integer=True))
+    ax_cummulated_rewards.legend(loc='best', fontsize='small', frameon=True, fancybox=True)
+    ax_cummulated_rewards.get_legend().set_title("Rewards accumulated")
+    ax_cummulated_rewards.set_ylabel(asset.rstrip('.S'), size=4)
+    ax_cummulated_rewards_base_currency.legend(loc='best', fontsize='small', frameon=True, fancybox=True)
+    ax_cummulated_rewards_base_currency.get_legend().set_title("Value on continuous sale vs. on timestamp")
+    ax_cummulated_rewards_base_currency.set_ylabel(base_currency, size=4)
+
+
+def render_asset_chart(asset, base_currency, chart_data, dpi=default_dpi, fmt='png'):
+    """
+    Renders the charts of one asset with the Agg backend. The figure is not registered with pyplot,
+    so nothing outlives the call.
+    :param dpi: resolution, lower values give smaller (downscaled) images
+    :param fmt: 'png' or 'svg' for a vector image
+    :return: bytes, the image
+    """
+    with matplotlib.rc_context({'font.size': 5}):
+        fig = Figure()
+        try:
+            FigureCanvas(fig)
+            plot_asset(fig, asset, base_currency, chart_data)
+            buf = io.BytesIO()
+            fig.savefig(buf, format=fmt, dpi=dpi, bbox_inches='tight')
+        finally:
+            fig.clear()
+    return buf.getvalue()
+
+
+def chart_key(asset, base_currency, chart_data, dpi=default_dpi, fmt='png'):
+    """
+    :return: str, hash of everything the rendered chart depends on
+    """
+    sha256 = hashlib.sha256(f"{asset}|{base_currency}|{dpi}|{fmt}".encode())
+    for name, series in sorted(chart_data.items()):
+        sha256.update(name.encode())
+        sha256.update(pd.util.hash_pandas_object(series).to_numpy().tobytes())
+    return sha256.hexdigest()
+
+
+def get_executor():
+    """
+    :return: concurrent.futures.ProcessPoolExecutor shared by all renders, started on first use
+    """
+    global executor
+    with executor_lock:
+        if executor is None:
+            # spawn: workers must not inherit the threads of a running Streamlit server
+            executor = concurrent.futures.ProcessPoolExecutor(mp_context=multiprocessing.get_context('spawn'))
+        return executor
+
+
+def render_charts(charts, dpi=default_dpi, parallel=True, fmt='png'):
+    """
+    Renders the charts of several assets, in worker processes if there are enough of them.
+    Charts are cached by data hash, unchanged charts are not rendered again.
+    :param charts: list of (asset, base_currency, chart_data)
+    :param dpi: resolution of the images
+    :param parallel: False to render in the calling process
+    :param fmt: 'png' or 'svg'
+    :return: list of bytes, the images in the order of charts
+    """
+    keys = [chart_key(asset, base_currency, chart_data, dpi, fmt) for asset, base_currency, chart_data in charts]
+    images = {}
+    with chart_cache_lock:
+        for key in keys:
+            if key in chart_cache:
+                chart_cache.move_to_end(key)
+                images[key] = chart_cache[key]
+    missing = {key: chart for key, chart in zip(keys, charts) if key not in images}
+
+    if parallel and len(missing) >= parallel_threshold:
+        futures = {key: get_executor().submit(render_asset_chart, *chart, dpi, fmt) for key, chart in missing.items()}
+        rendered = {key: future.result() for key, future in futures.items()}
+    else:
+        rendered = {key: render_asset_chart(*chart, dpi, fmt) for key, chart in missing.items()}
+
+    with chart_cache_lock:
+        for key, image in rendered.items():
+            chart_cache[key] = image
+        while len(chart_cache) > max_cached_charts:
+            chart_cache.popitem(last=False)
+    images.update(rendered)
+    return [images[key] for key in keys]
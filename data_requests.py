@@ -1,86 +1,726 @@
+import collections
+import concurrent.futures
+import os
 import pathlib
+import threading
+import time
+import numpy as np
 import pandas as pd
 import datetime
 # DB Management
 import requests
 import sqlalchemy as sqlalchemy
-import streamlit as st
+import instrumentation as instrumentation
 
 db_name = 'HLOCV.db'
 root_dir0 = pathlib.Path(__file__).resolve().parents[0]
 db_path = 'sqlite:///' + str(pathlib.Path.joinpath(root_dir0, db_name))
 
-engine = sqlalchemy.create_engine(db_path, echo=True, connect_args={"check_same_thread": False, 'timeout': 5})
-conn = engine.connect()
+ohlc_table_name = 'ohlc'
+sync_table_name = 'ohlc_sync'
+ohlc_columns = ['timestamp', 'open', 'high', 'low', 'close', 'vwap', 'volume', 'count']
+# opt-in SQL logging for debugging, STAKING_REWARDS_SQL_ECHO=1 logs every statement, =debug the result rows too:
+sql_echo = os.environ.get('STAKING_REWARDS_SQL_ECHO', '').lower()
 
+kraken_ohlc_url = 'https://api.kraken.com/0/public/OHLC'
+# timeframes in minutes kept in the store, rewards are valued at the finest bar covering them.
+# kraken only serves the latest 720 bars of every interval, hourly history builds up with regular syncs:
+sync_intervals = (60, 1440)
+# kraken returns at most 720 bars per OHLC request:
+max_bars_per_request = 720
+request_timeout = 10
+max_retries = 4
+# seconds, doubled on every retry:
+retry_backoff = 1.0
+# kraken errors worth retrying, everything else (e.g. EQuery:Unknown asset pair) fails immediately:
+retryable_api_errors = ('EAPI:Rate limit exceeded', 'EService:Unavailable', 'EService:Busy')
 
-def download_ticker_df(ticker, start, interval=1440):
+schema_statements = [
+    # WITHOUT ROWID stores the rows in primary key order, so the key is a covering index for all
+    # point and range lookups by pair, interval and timestamp:
+    f"CREATE TABLE IF NOT EXISTS {ohlc_table_name} ("
+    f"pair TEXT NOT NULL, interval INTEGER NOT NULL, timestamp INTEGER NOT NULL, "
+    f"open REAL, high REAL, low REAL, close REAL, vwap REAL, volume REAL, count INTEGER, "
+    f"PRIMARY KEY (pair, interval, timestamp)) WITHOUT ROWID",
+    f"CREATE TABLE IF NOT EXISTS {sync_table_name} ("
+    f"pair TEXT NOT NULL, interval INTEGER NOT NULL, start INTEGER, last INTEGER, "
+    f"min_timestamp INTEGER, max_timestamp INTEGER, synced_at INTEGER, generation INTEGER NOT NULL DEFAULT 0, "
+    f"PRIMARY KEY (pair, interval))",
+]
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    # WAL lets the app read while a sync writes:
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+
+def create_db_engine(db_url):
+    echo = 'debug' if sql_echo == 'debug' else sql_echo not in ('', '0', 'false')
+    db_engine = sqlalchemy.create_engine(db_url, echo=echo,
+                                         connect_args={"check_same_thread": False, 'timeout': 5})
+    sqlalchemy.event.listen(db_engine, 'connect', set_sqlite_pragmas)
+    instrumentation.instrument_engine(db_engine)
+    return db_engine
+
+
+def init_db(db_engine):
+    """
+    Creates the ohlc and sync tables and moves tables of the old one-table-per-ticker layout into them.
+    :param db_engine: sqlalchemy.engine.Engine
+    """
+    inspector = sqlalchemy.inspect(db_engine)
+    sync_columns = {column['name'] for column in inspector.get_columns(sync_table_name)} \
+        if inspector.has_table(sync_table_name) else set()
+    with db_engine.begin() as connection:
+        # cursors of the former per-ticker sync table are dropped, the next sync starts from the requested start:
+        if sync_columns and 'pair' not in sync_columns:
+            connection.execute(sqlalchemy.sql.text(f"DROP TABLE {sync_table_name}"))
+        for statement in schema_statements:
+            connection.execute(sqlalchemy.sql.text(statement))
+        if 'pair' in sync_columns and 'generation' not in sync_columns:
+            connection.execute(sqlalchemy.sql.text(
+                f"ALTER TABLE {sync_table_name} ADD COLUMN generation INTEGER NOT NULL DEFAULT 0"))
+    migrate_legacy_tables(db_engine)
+
+
+def migrate_legacy_tables(db_engine):
+    """
+    Copies every table of the old layout (one untyped table per ticker, created by DataFrame.to_sql)
+    into the ohlc table as daily bars and drops it.
+    :param db_engine: sqlalchemy.engine.Engine
+    :return: list of migrated tickers
+    """
+    inspector = sqlalchemy.inspect(db_engine)
+    migrated = []
+    for table_name in inspector.get_table_names():
+        if table_name in (ohlc_table_name, sync_table_name):
+            continue
+        columns = {column['name'] for column in inspector.get_columns(table_name)}
+        if not set(ohlc_columns).issubset(columns):
+            continue
+        with db_engine.begin() as connection:
+            # table_name comes from sqlite_master, not from user input:
+            connection.execute(sqlalchemy.sql.text(
+                f"INSERT INTO {ohlc_table_name} (pair, interval, {', '.join(ohlc_columns)}) "
+                f"SELECT :pair, 1440, CAST(timestamp AS INTEGER), open, high, low, close, vwap, volume, count "
+                f"FROM \"{table_name}\" WHERE timestamp IS NOT NULL "
+                f"ON CONFLICT (pair, interval, timestamp) DO NOTHING"), {'pair': table_name})
+            connection.execute(sqlalchemy.sql.text(f"DROP TABLE \"{table_name}\""))
+        migrated.append(table_name)
+    return migrated
+
+
+class Database:
+    """
+    Engine of the price database. The connection pool is created and the schema is initialized on first use,
+    importing the module opens nothing.
+    :param db_url: sqlalchemy database url
+    """
+
+    def __init__(self, db_url):
+        self.db_url = db_url
+        self.engine = None
+        self.lock = threading.Lock()
+
+    def get_engine(self):
+        """
+        :return: sqlalchemy.engine.Engine, created on the first call
+        """
+        with self.lock:
+            if self.engine is None:
+                db_engine = create_db_engine(self.db_url)
+                try:
+                    init_db(db_engine)
+                except sqlalchemy.exc.SQLAlchemyError:
+                    db_engine.dispose()
+                    raise
+                self.engine = db_engine
+            return self.engine
+
+    def connect(self):
+        """
+        :return: sqlalchemy Connection from the pool, used as context manager it is returned afterwards
+        """
+        return self.get_engine().connect()
+
+    def begin(self):
+        """
+        :return: context manager of a Connection in a transaction, committed on success
+        """
+        return self.get_engine().begin()
+
+    def close(self):
+        """
+        Closes all pooled connections, the next use opens the database again.
+        """
+        with self.lock:
+            if self.engine is not None:
+                self.engine.dispose()
+                self.engine = None
+
+
+database = Database(db_path)
+
+
+def use_database(db_url):
+    """
+    Points the module to another database, e.g. a temporary file in tests.
+    :param db_url: sqlalchemy database url
+    """
+    global database
+    database.close()
+    database = Database(db_url)
+    price_cache.invalidate()
+
+
+class MissingPriceError(LookupError):
+    """Raised when the database holds no price for a ticker at a requested timestamp."""
+
+
+class PriceCache:
+    """
+    LRU cache of OHLC reads, keyed by (ticker, interval, start, end). Frames are kept as one NumPy array per
+    column, so repeated Streamlit reruns over the same ledger are answered without reading the bars again.
+    Entries are stored with the sync generation of their ticker, writes of other processes (e.g. batch.py --update)
+    are not invalidated here but turn the entries into misses.
+    :param max_bytes: size bound of all cached arrays, least recently used entries are evicted first
+    """
+    dtypes = {'timestamp': np.int64, 'open': np.float64, 'high': np.float64, 'low': np.float64,
+              'close': np.float64, 'vwap': np.float64, 'volume': np.float64, 'count': np.int64}
+
+    def __init__(self, max_bytes=64 * 1024 ** 2):
+        self.max_bytes = max_bytes
+        self.entries = collections.OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        # bumped by invalidate, a read that started before an invalidation is not cached:
+        self.generations = collections.Counter()
+        self.lock = threading.Lock()
+
+    def get(self, key, db_generation=None):
+        """
+        :param db_generation: current sync generation of the ticker, an entry stored at another one is dropped
+        :return: dict of column arrays or None on a miss
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] != db_generation:
+                self.nbytes -= self.entry_bytes(self.entries.pop(key))
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def generation(self, ticker):
+        """
+        :return: token to pass to put, taken before reading the rows of ticker from the database
+        """
+        with self.lock:
+            return self.generations[None], self.generations[ticker]
+
+    def put(self, key, df, generation=None, db_generation=None):
+        """
+        :param key: (ticker, interval, start, end)
+        :param df: pd.DataFrame with the ohlc columns
+        :param generation: as returned by generation before df was read, df is not cached if the ticker
+            was invalidated since, e.g. by a sync that committed while df was read
+        :param db_generation: sync generation of the ticker, read before df
+        :return: dict of column arrays
+        """
+        arrays = {column: df[column].to_numpy(dtype=dtype, na_value=np.nan if dtype is np.float64 else 0)
+                  for column, dtype in self.dtypes.items()}
+        size = sum(array.nbytes for array in arrays.values())
+        with self.lock:
+            if generation is not None and generation != (self.generations[None], self.generations[key[0]]):
+                return arrays
+            if key in self.entries:
+                self.nbytes -= self.entry_bytes(self.entries.pop(key))
+            self.entries[key] = (db_generation, arrays)
+            self.nbytes += size
+            while self.nbytes > self.max_bytes and len(self.entries) > 1:
+                self.nbytes -= self.entry_bytes(self.entries.popitem(last=False)[1])
+        return arrays
+
+    def invalidate(self, ticker=None, interval=None):
+        """
+        Drops all entries of a ticker (and interval), or everything if ticker is None.
+        """
+        with self.lock:
+            self.generations[ticker] += 1
+            for key in list(self.entries):
+                if ticker is None or (key[0] == ticker and (interval is None or key[1] == interval)):
+                    self.nbytes -= self.entry_bytes(self.entries.pop(key))
+
+    def info(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.entries), 'bytes': self.nbytes}
+
+    @staticmethod
+    def entry_bytes(entry):
+        return sum(array.nbytes for array in entry[1].values())
+
+
+price_cache = PriceCache()
+
+
+class TokenBucket:
+    """
+    Thread safe token bucket: acquire() blocks until a token is available.
+    :param rate: tokens added per second
+    :param capacity: max tokens, i.e. the allowed burst
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+# kraken's public endpoints allow about one request per second:
+rate_limiter = TokenBucket(rate=1.0, capacity=3)
+
+session = requests.Session()
+session.mount('https://', requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=8))
+session.mount('http://', requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=8))
+
+
+def kraken_get(params):
+    """
+    GET on the kraken OHLC endpoint through the pooled session, rate limited and retried with exponential
+    backoff on connection errors, 5xx/429 responses and retryable kraken errors.
+    :param params: dict of query parameters
+    :return: dict, the decoded response
+    """
+    for attempt in range(max_retries + 1):
+        rate_limiter.acquire()
+        started = time.perf_counter()
+        try:
+            try:
+                res = session.get(kraken_ohlc_url, params=params, timeout=request_timeout)
+            finally:
+                seconds = time.perf_counter() - started
+                instrumentation.count('http.requests')
+                instrumentation.observe('http.kraken_ohlc', seconds)
+            instrumentation.log_event({'event': 'http', 'pair': params['pair'], 'status': res.status_code,
+                                       'seconds': seconds, 'attempt': attempt})
+            if res.status_code == 429 or res.status_code >= 500:
+                raise requests.HTTPError(f"{res.status_code} for ticker {params['pair']}", response=res)
+            data = res.json()
+            if not any(error.startswith(retryable_api_errors) for error in data.get('error', [])):
+                return data
+            error = ValueError(f"kraken api error for ticker {params['pair']}: {data['error']}")
+        except (requests.RequestException, ValueError) as e:
+            error = e
+        instrumentation.count('http.failures')
+        if attempt < max_retries:
+            time.sleep(retry_backoff * 2 ** attempt)
+    raise error
+
+
+def download_ticker_page(ticker, since, interval=1440):
     """
     Example requ: requests.get('https://api.kraken.com/0/public/OHLC?pair=XBTUSD')
-    :param interval: timeframe in minutes (1d: 1440)
+    Kraken returns at most 720 bars per request, the last one is the still open bar.
     :param ticker: str
-    :param start: linuxtmps
-    :return: pd.Dataframe
+    :param since: linuxtmps, return bars after this cursor
+    :param interval: timeframe in minutes (1d: 1440)
+    :return: (pd.Dataframe, last) where last is the cursor to request the next page with
     """
-    url = 'https://api.kraken.com/0/public/OHLC'
-    params = {'pair': ticker, 'interval': interval, 'since': start}
-    res = requests.get(url, params=params)
-    data = res.json()
-    print(data)
-    if ticker == "XBTUSD":
-        df = pd.DataFrame(data['result']["XXBTZUSD"])
-    if ticker == "XBTEUR":
-        df = pd.DataFrame(data['result']["XXBTZEUR"])
-    else:
-        df = pd.DataFrame(data['result'][ticker])
-    df.columns = ['timestamp', 'open', 'high', 'low', 'close', 'vwap', 'volume', 'count']
+    data = kraken_get({'pair': ticker, 'interval': interval, 'since': since})
+    if data.get('error'):
+        raise ValueError(f"kraken api error for ticker {ticker}: {data['error']}")
+    # kraken answers with its own pair name, e.g. XXBTZUSD for XBTUSD:
+    result_key = next(key for key in data['result'] if key != 'last')
+    df = pd.DataFrame(data['result'][result_key],
+                      columns=['timestamp', 'open', 'high', 'low', 'close', 'vwap', 'volume', 'count'])
 
     # Convert the columns to float
     df = df.apply(pd.to_numeric, errors='coerce')
 
     df['ticker'] = ticker
+    return df, int(data['result']['last'])
+
+
+def download_ticker_df(ticker, start, interval=1440):
+    """
+    Downloads all bars after start, following kraken's last cursor page by page.
+    :param interval: timeframe in minutes (1d: 1440)
+    :param ticker: str
+    :param start: linuxtmps
+    :return: pd.Dataframe
+    """
+    df, _ = download_ticker_pages(ticker, start, interval)
     return df
 
 
-def add_ohlc(ticker, start):
-    df = download_ticker_df(ticker, start)
-    df.to_sql(ticker, engine, if_exists='replace', index=False)
+def download_ticker_pages(ticker, start, interval=1440):
+    """
+    :param ticker: str
+    :param start: linuxtmps
+    :param interval: timeframe in minutes (1d: 1440)
+    :return: (pd.Dataframe, last) with the bars of all pages and the cursor of the last page
+    """
+    df_list = []
+    since = int(start)
+    while True:
+        df, last = download_ticker_page(ticker, since, interval)
+        df_list.append(df)
+        # a page shorter than the limit is the most recent one:
+        if len(df) < max_bars_per_request or last <= since:
+            break
+        since = last
+    df = pd.concat(df_list, ignore_index=True)
+    df = df.drop_duplicates(subset='timestamp', keep='last').reset_index(drop=True)
+    return df, last
+
+
+def get_sync_state(ticker, interval=1440):
+    """
+    :param ticker: str (SOLEUR)
+    :param interval: timeframe in minutes
+    :return: dict with start, last, min_timestamp, max_timestamp, synced_at and generation,
+        None if ticker was never synced
+    start is the earliest linuxtmps the ticker was requested from, last the kraken cursor of the latest sync
+    """
+    sqlite_query_string = sqlalchemy.sql.text(
+        f"SELECT * FROM {sync_table_name} WHERE pair = :pair AND interval = :interval")
+    with database.connect() as connection:
+        df = pd.read_sql(sqlite_query_string, con=connection, params={'pair': ticker, 'interval': interval})
+    if df.empty:
+        return None
+    return df.iloc[0].to_dict()
+
+
+def sync_generation(ticker_list, interval=None):
+    """
+    :param ticker_list: list of str
+    :param interval: timeframe in minutes, None for any interval
+    :return: int, generation of the latest write of any of the tickers, 0 if none was synced
+    Increases with every upsert, also with several in the same second, results derived from the prices of the
+    tickers can be keyed by it.
+    """
+    interval_condition = '' if interval is None else ' AND interval = :interval'
+    sqlite_query_string = sqlalchemy.sql.text(
+        f"SELECT MAX(generation) FROM {sync_table_name} WHERE pair IN :pairs{interval_condition}"
+    ).bindparams(sqlalchemy.bindparam('pairs', expanding=True))
+    with database.connect() as connection:
+        generation = connection.execute(sqlite_query_string,
+                                        {'pairs': list(ticker_list), 'interval': interval}).scalar()
+    return int(generation or 0)
+
+
+def set_sync_state(connection, ticker, interval, start, last):
+    # the generation counts across all tickers, so the maximum of any set of tickers grows with each of their
+    # writes; it runs inside the write transaction of the upsert, concurrent writers get distinct numbers:
+    connection.execute(sqlalchemy.sql.text(
+        f"INSERT INTO {sync_table_name} "
+        f"(pair, interval, start, last, min_timestamp, max_timestamp, synced_at, generation) "
+        f"SELECT :pair, :interval, :start, :last, MIN(timestamp), MAX(timestamp), :synced_at, "
+        f"(SELECT COALESCE(MAX(generation), 0) + 1 FROM {sync_table_name}) "
+        f"FROM {ohlc_table_name} WHERE pair = :pair AND interval = :interval "
+        f"ON CONFLICT (pair, interval) DO UPDATE SET start = excluded.start, last = excluded.last, "
+        f"min_timestamp = excluded.min_timestamp, max_timestamp = excluded.max_timestamp, "
+        f"synced_at = excluded.synced_at, generation = excluded.generation"),
+        {'pair': ticker, 'interval': interval, 'start': int(start), 'last': int(last),
+         'synced_at': int(datetime.datetime.now(datetime.timezone.utc).timestamp())})
+
+
+def upsert_ohlc(ticker, df, start, last, interval=1440):
+    """
+    Writes downloaded bars into the ohlc table. Bars with an already stored timestamp are replaced,
+    this keeps the still open last bar of the previous sync up to date.
+    :param ticker: str
+    :param df: pd.Dataframe as returned by download_ticker_df
+    :param start: earliest linuxtmps the table now covers
+    :param last: kraken cursor of the download
+    :param interval: timeframe in minutes
+    """
+    records = df[ohlc_columns].astype({'timestamp': 'int64'}).to_dict('records')
+    for record in records:
+        record['pair'] = ticker
+        record['interval'] = interval
+    with database.begin() as connection:
+        if records:
+            connection.execute(sqlalchemy.sql.text(
+                f"INSERT INTO {ohlc_table_name} (pair, interval, {', '.join(ohlc_columns)}) "
+                f"VALUES (:pair, :interval, {', '.join(':' + column for column in ohlc_columns)}) "
+                f"ON CONFLICT (pair, interval, timestamp) DO UPDATE SET "
+                + ', '.join(f"{column} = excluded.{column}" for column in ohlc_columns[1:])),
+                records)
+        set_sync_state(connection, ticker, interval, start, last)
+    # coarser intervals may be derived from the written bars:
+    price_cache.invalidate(ticker)
+
+
+def plan_sync(ticker, start, interval=1440, incremental=True):
+    """
+    :param ticker: str
+    :param start: linuxtmps
+    :param interval: timeframe in minutes
+    :param incremental: False to download everything from start again
+    :return: (since, start) the cursor to download from and the earliest linuxtmps the table covers afterwards
+    If the table already covers start, since is the cursor of the last sync.
+    """
+    start = int(start)
+    since = start
+    sync_state = get_sync_state(ticker, interval)
+    if sync_state is not None and sync_state['start'] <= start:
+        if incremental:
+            since = max(start, int(sync_state['last']))
+        start = int(sync_state['start'])
+    return since, start
+
+
+def add_ohlc(ticker, start, interval=1440, incremental=True):
+    """
+    Syncs the ticker table with kraken. If the table already covers start, only bars after the cursor of
+    the last sync are requested, otherwise the history is downloaded from start and merged into the table.
+    :param ticker: str
+    :param start: linuxtmps
+    :param interval: timeframe in minutes
+    :param incremental: False to download everything from start again
+    :return: number of downloaded bars
+    """
+    since, start = plan_sync(ticker, start, interval, incremental)
+    df, last = download_ticker_pages(ticker, since, interval)
+    upsert_ohlc(ticker, df, start, last, interval)
+    return len(df)
+
+
+def resample_ohlc(df, interval, source_interval):
+    """
+    Derives bars of a coarser interval from bars of a finer one. Only buckets holding all of their finer bars
+    are returned, an incomplete bucket would give a wrong open, high, low or close.
+    :param df: pd.DataFrame with the ohlc_columns, bars of source_interval sorted by timestamp
+    :param interval: timeframe in minutes of the derived bars, a multiple of source_interval
+    :param source_interval: timeframe in minutes of the bars in df
+    :return: pd.DataFrame with the ohlc_columns sorted by timestamp
+    """
+    step = interval * 60
+    buckets = df.assign(bucket=df['timestamp'].to_numpy(dtype=np.int64) // step * step,
+                        turnover=df['vwap'] * df['volume']).groupby('bucket', sort=True)
+    bars = buckets.agg(open=('open', 'first'), high=('high', 'max'), low=('low', 'min'), close=('close', 'last'),
+                       turnover=('turnover', 'sum'), mean_vwap=('vwap', 'mean'), volume=('volume', 'sum'),
+                       count=('count', 'sum'), bars=('timestamp', 'size'))
+    bars = bars[bars['bars'] == interval // source_interval]
+    volume = bars['volume'].to_numpy(dtype=float)
+    # volume weighted, the plain mean where nothing was traded:
+    bars['vwap'] = np.divide(bars['turnover'].to_numpy(dtype=float), volume,
+                             out=bars['mean_vwap'].to_numpy(dtype=float), where=volume > 0)
+    return bars.rename_axis('timestamp').reset_index()[ohlc_columns]
+
+
+def read_ohlc(ticker, start=None, end=None, interval=1440):
+    """
+    Reads the stored bars of the interval and fills gaps with bars derived from the finest stored interval
+    that divides it, e.g. daily bars from hourly ones, instead of downloading them.
+    :return: pd.DataFrame sorted by timestamp
+    """
+    df = get_ohlc_range_from_db([ticker], start, end, interval)
+    source_intervals = [source for source in sync_intervals if source < interval and interval % source == 0]
+    if not source_intervals:
+        return df
+    step = interval * 60
+    # every bar of the range is stored:
+    if start is not None and end is not None and len(df) >= len(range(start + -start % step, end + 1, step)):
+        return df
+    source_interval = min(source_intervals)
+    # finer bars of the buckets overlapping [start, end], from the start of the bucket covering start:
+    source_ranges = [(None if start is None else start // step * step,
+                      None if end is None else end // step * step + step - 1)]
+    if not df.empty:
+        # the stored bars are contiguous up to the first gap, only the buckets around them are derived:
+        timestamps = df['timestamp'].to_numpy(dtype=np.int64)
+        gaps = np.flatnonzero(np.diff(timestamps) > step)
+        contiguous_end = timestamps[gaps[0] if len(gaps) else -1]
+        source_ranges = [(source_ranges[0][0], int(timestamps[0]) - 1),
+                         (int(contiguous_end) + step, source_ranges[0][1])]
+    source_ranges = [(range_start, range_end) for range_start, range_end in source_ranges
+                     if range_start is None or range_end is None or range_start <= range_end]
+    if not source_ranges:
+        return df
+    source_df = pd.concat([get_ohlc_range_from_db([ticker], range_start, range_end, source_interval)
+                           for range_start, range_end in source_ranges], ignore_index=True)
+    instrumentation.count('ohlc.source_bars', len(source_df))
+    derived = resample_ohlc(source_df, interval, source_interval)
+    derived = derived[~derived['timestamp'].isin(df['timestamp'])
+                      & (derived['timestamp'] >= (start if start is not None else -2 ** 63))
+                      & (derived['timestamp'] <= (end if end is not None else 2 ** 63 - 1))]
+    if derived.empty:
+        return df
+    instrumentation.count('ohlc.derived_bars', len(derived))
+    return pd.concat([df, derived.assign(ticker=ticker)], ignore_index=True).sort_values(
+        'timestamp', ignore_index=True)
 
 
-def get_ohlc_from_db(ticker):
-    sqlite_query_string = sqlalchemy.sql.text(f"SELECT * FROM {ticker}")
-    df = pd.read_sql(sqlite_query_string, con=conn)
+def get_ohlc_from_db(ticker, start=None, end=None, interval=1440):
+    """
+    Served from price_cache if the same range was read before and the ticker was not synced since,
+    by this or another process.
+    :param ticker: str (SOLEUR)
+    :param start: linux timestamp, first bar to return, None for all history
+    :param end: linux timestamp, last bar to return, None for all history
+    :param interval: timeframe in minutes, gaps are filled with bars resampled from a finer stored interval
+    :return: pd.DataFrame sorted by timestamp, empty if the ticker is not in the database
+    """
+    key = (ticker, interval, start, end)
+    # one primary key lookup, read before the bars so a sync committing in between only causes another miss:
+    db_generation = sync_generation([ticker])
+    arrays = price_cache.get(key, db_generation)
+    if arrays is None:
+        instrumentation.count('price_cache.misses')
+        generation = price_cache.generation(ticker)
+        arrays = price_cache.put(key, read_ohlc(ticker, start, end, interval), generation, db_generation)
+    else:
+        instrumentation.count('price_cache.hits')
+    df = pd.DataFrame(arrays)
+    df['ticker'] = ticker
     return df
 
 
-def get_ticker_from_db(ticker, timestamp):
+def price_cache_info():
+    """
+    :return: dict with hits, misses, entries and bytes of the in-process price cache
+    """
+    return price_cache.info()
+
+
+def get_ohlc_range_from_db(ticker_list, start=None, end=None, interval=1440):
+    """
+    Reads the bars of several tickers within one date window with a single query.
+    :param ticker_list: list of str
+    :param start: linux timestamp, None for all history
+    :param end: linux timestamp, None for all history
+    :param interval: timeframe in minutes
+    :return: pd.DataFrame with the columns timestamp, open, high, low, close, vwap, volume, count, ticker
+    """
+    sqlite_query_string = sqlalchemy.sql.text(
+        f"SELECT {', '.join(ohlc_columns)}, pair AS ticker FROM {ohlc_table_name} "
+        f"WHERE pair IN :pairs AND interval = :interval AND timestamp BETWEEN :start AND :end "
+        f"ORDER BY pair, timestamp").bindparams(sqlalchemy.bindparam('pairs', expanding=True))
+    params = {'pairs': list(ticker_list), 'interval': interval,
+              'start': -2 ** 63 if start is None else int(start), 'end': 2 ** 63 - 1 if end is None else int(end)}
+    with database.connect() as connection:
+        return pd.read_sql(sqlite_query_string, con=connection, params=params)
+
+
+def get_ticker_from_db(ticker, timestamp, interval=1440):
     """
     :param ticker: str (SOLEUR)
     :param timestamp: linux timestamp
+    :param interval: timeframe in minutes
     :return:
     return df like:
         timestamp   open  high   low  close   vwap        volume  count  ticker
     0   1672012800  10.68  10.8  10.4  10.63  10.56  36129.483519   1115  SOLEUR
+    raises MissingPriceError if there is no bar for ticker and timestamp
     """
-    sqlite_query_string = sqlalchemy.sql.text(f"SELECT * FROM {ticker} WHERE timestamp = '{timestamp}'")
-    df = pd.read_sql(sqlite_query_string, con=conn)
+    sqlite_query_string = sqlalchemy.sql.text(
+        f"SELECT {', '.join(ohlc_columns)}, pair AS ticker FROM {ohlc_table_name} "
+        f"WHERE pair = :pair AND interval = :interval AND timestamp = :timestamp")
+    with database.connect() as connection:
+        df = pd.read_sql(sqlite_query_string, con=connection,
+                         params={'pair': ticker, 'interval': interval, 'timestamp': int(float(timestamp))})
     if df.empty:
-        st.error(f"ticker: {ticker} or/and timestamp: {timestamp} not in database")
-        st.stop()
+        raise MissingPriceError(f"ticker: {ticker} or/and timestamp: {timestamp} not in database")
     return df
 
 
-def add_list_of_ohlc(ticker_list, start):
-    for ticker in ticker_list:
-        add_ohlc(ticker, start)
+def timed_download(ticker, since, interval):
+    started = time.perf_counter()
+    df, last = download_ticker_pages(ticker, since, interval)
+    return df, last, time.perf_counter() - started
+
+
+def add_list_of_ohlc(ticker_list, start, incremental=True, interval=1440, max_workers=4):
+    """
+    Downloads the tickers concurrently through the shared session and rate limiter,
+    the database is written from the calling thread only.
+    :param ticker_list: list of str
+    :param start: linuxtmps
+    :param incremental: False to download everything from start again
+    :param interval: timeframe in minutes
+    :param max_workers: number of concurrent downloads
+    :return: dict ticker -> {'bars': int, 'latency': seconds} or {'error': str} if the ticker failed
+    """
+    report = {}
+    plans = {ticker: plan_sync(ticker, start, interval, incremental) for ticker in ticker_list}
+    with instrumentation.stage('db_sync'), concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(timed_download, ticker, since, interval): ticker
+                   for ticker, (since, _) in plans.items()}
+        for future in concurrent.futures.as_completed(futures):
+            ticker = futures[future]
+            try:
+                df, last, latency = future.result()
+            except (requests.RequestException, ValueError, KeyError) as e:
+                report[ticker] = {'error': str(e)}
+                continue
+            try:
+                upsert_ohlc(ticker, df, plans[ticker][1], last, interval)
+            # e.g. a database locked by another writer, the other tickers are still written:
+            except sqlalchemy.exc.SQLAlchemyError as e:
+                report[ticker] = {'error': str(e)}
+                continue
+            report[ticker] = {'bars': len(df), 'latency': latency}
+    return report
+
+
+def sync_list_of_ohlc(ticker_list, start, incremental=True, intervals=None, max_workers=4, progress=None):
+    """
+    Syncs the tickers at every interval of the store, coarsest first.
+    :param ticker_list: list of str
+    :param start: linuxtmps
+    :param incremental: False to download everything from start again
+    :param intervals: timeframes in minutes, defaults to sync_intervals
+    :param max_workers: number of concurrent downloads
+    :param progress: callable(interval, report) called after every interval with the report of add_list_of_ohlc
+    :return: dict ticker -> {'bars': int, 'latency': seconds} summed over the intervals,
+    or {'error': str} if an interval failed
+    """
+    if intervals is None:
+        intervals = sync_intervals
+    report = {ticker: {'bars': 0, 'latency': 0.0} for ticker in ticker_list}
+    for interval in sorted(intervals, reverse=True):
+        interval_report = add_list_of_ohlc(ticker_list, start, incremental, interval, max_workers)
+        if progress is not None:
+            progress(interval, interval_report)
+        for ticker, result in interval_report.items():
+            if 'error' in result:
+                report[ticker] = {'error': f"interval {interval}: {result['error']}"}
+            elif 'error' not in report[ticker]:
+                report[ticker]['bars'] += result['bars']
+                report[ticker]['latency'] += result['latency']
+    return report
 
 
 def get_list_of_ohlc_from_db(ticker_list):
-    df_list = []
-    for ticker in ticker_list:
-        df_list.append(get_ohlc_from_db(ticker))
-    return df_list
+    df = get_ohlc_range_from_db(ticker_list)
+    return [df[df['ticker'] == ticker].reset_index(drop=True) for ticker in ticker_list]
 
 
-def close_db_connection(self):
-    self.conn.close()
+def close_db_connection():
+    """
+    Closes the connections of the current database, e.g. before the process exits.
+    """
+    database.close()
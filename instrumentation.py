@@ -0,0 +1,220 @@
+"""
+Timings, SQL and HTTP statistics and memory of the pipeline, for the diagnostics panel of the app and a JSON log.
+
+Environment variables:
+    STAKING_REWARDS_METRICS_LOG: path of a file every finished stage, HTTP call and snapshot is appended to as
+        one JSON object per line
+    STAKING_REWARDS_TRACE_MEMORY: 1 to measure the peak Python memory of every stage with tracemalloc,
+        which slows the app down noticeably. tracemalloc traces the whole process, the peaks are only meaningful
+        while a single session or thread runs stages, e.g. when profiling one session locally
+"""
+import bisect
+import collections
+import contextlib
+import datetime
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import sqlalchemy as sqlalchemy
+try:
+    import resource
+except ImportError:
+    # not available on windows
+    resource = None
+
+json_log_path = os.environ.get('STAKING_REWARDS_METRICS_LOG') or None
+trace_memory = os.environ.get('STAKING_REWARDS_TRACE_MEMORY', '') not in ('', '0')
+# upper bounds in seconds of the latency histogram buckets, the last bucket takes everything slower:
+latency_buckets = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+json_log_lock = threading.Lock()
+stage_stack = threading.local()
+
+
+class Metrics:
+    """
+    Thread safe collection of stage timings, counters and latency histograms.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            # name -> {'count', 'seconds', 'max_seconds', 'peak_memory_bytes'}
+            self.stages = collections.OrderedDict()
+            self.counters = collections.Counter()
+            # name -> list of bucket counts, one more than latency_buckets
+            self.histograms = {}
+            self.histogram_sums = collections.Counter()
+
+    def add_stage(self, name, seconds, peak_memory_bytes=None):
+        with self.lock:
+            stage = self.stages.setdefault(name, {'count': 0, 'seconds': 0.0, 'max_seconds': 0.0,
+                                                  'peak_memory_bytes': None})
+            stage['count'] += 1
+            stage['seconds'] += seconds
+            stage['max_seconds'] = max(stage['max_seconds'], seconds)
+            if peak_memory_bytes is not None:
+                stage['peak_memory_bytes'] = max(stage['peak_memory_bytes'] or 0, peak_memory_bytes)
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+    def observe(self, name, seconds):
+        """
+        Adds a latency to the histogram name.
+        """
+        with self.lock:
+            buckets = self.histograms.setdefault(name, [0] * (len(latency_buckets) + 1))
+            buckets[bisect.bisect_left(latency_buckets, seconds)] += 1
+            self.histogram_sums[name] += seconds
+
+    def snapshot(self):
+        """
+        :return: dict of plain types, e.g. for json.dumps
+        """
+        bucket_names = [f'<={bound}s' for bound in latency_buckets] + [f'>{latency_buckets[-1]}s']
+        with self.lock:
+            return {
+                'stages': {name: dict(stage) for name, stage in self.stages.items()},
+                'counters': dict(self.counters),
+                'histograms': {name: {'count': sum(buckets), 'seconds': self.histogram_sums[name],
+                                      'buckets': dict(zip(bucket_names, buckets))}
+                               for name, buckets in self.histograms.items()},
+                'max_rss_bytes': max_rss_bytes(),
+            }
+
+
+# everything since the start of the process:
+metrics = Metrics()
+# Metrics of running captures, they receive every event while they are active:
+active_captures = []
+active_captures_lock = threading.Lock()
+
+
+def receivers():
+    with active_captures_lock:
+        return [metrics] + active_captures
+
+
+def count(name, value=1):
+    for receiver in receivers():
+        receiver.count(name, value)
+
+
+def observe(name, seconds):
+    for receiver in receivers():
+        receiver.observe(name, seconds)
+
+
+@contextlib.contextmanager
+def capture():
+    """
+    Collects the events while the block runs, e.g. of one rerun of the app. Events of concurrent sessions
+    and threads are included as well.
+    :return: Metrics
+    """
+    captured = Metrics()
+    with active_captures_lock:
+        active_captures.append(captured)
+    try:
+        yield captured
+    finally:
+        with active_captures_lock:
+            active_captures.remove(captured)
+
+
+@contextlib.contextmanager
+def stage(name):
+    """
+    Times the block as stage name, with its peak Python memory if trace_memory is set. Stages may be nested.
+    The peak includes allocations of concurrent threads, e.g. of other sessions or the updater.
+    """
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    tracing = tracemalloc.is_tracing()
+    if not hasattr(stage_stack, 'frames'):
+        stage_stack.frames = []
+    frame = {'peak': 0}
+    if tracing:
+        # the peak of the enclosing stage so far is kept in its frame before the peak is reset for this one:
+        if stage_stack.frames:
+            outer = stage_stack.frames[-1]
+            outer['peak'] = max(outer['peak'], tracemalloc.get_traced_memory()[1])
+        start_memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+    stage_stack.frames.append(frame)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        stage_stack.frames.pop()
+        peak_memory_bytes = None
+        if tracing and tracemalloc.is_tracing():
+            peak = max(frame['peak'], tracemalloc.get_traced_memory()[1])
+            peak_memory_bytes = max(peak - start_memory, 0)
+            if stage_stack.frames:
+                stage_stack.frames[-1]['peak'] = max(stage_stack.frames[-1]['peak'], peak)
+        for receiver in receivers():
+            receiver.add_stage(name, seconds, peak_memory_bytes)
+        log_event({'event': 'stage', 'name': name, 'seconds': seconds, 'peak_memory_bytes': peak_memory_bytes})
+
+
+def max_rss_bytes():
+    """
+    :return: int, peak resident memory of the process or None where the platform does not report it
+    """
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # linux reports kilobytes, macOS bytes:
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+def log_event(record):
+    """
+    Appends record with a timestamp as one JSON line to json_log_path, does nothing if it is not set.
+    :param record: dict of plain types
+    """
+    if json_log_path is None:
+        return
+    line = json.dumps({'time': datetime.datetime.now(datetime.timezone.utc).isoformat(), **record})
+    with json_log_lock:
+        with open(json_log_path, 'a') as f:
+            f.write(line + '\n')
+
+
+def before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    connection.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+def after_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    seconds = time.perf_counter() - connection.info['query_started'].pop()
+    kind = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else 'OTHER'
+    count('sql.queries')
+    count('sql.queries.' + kind)
+    observe('sql.' + kind, seconds)
+
+
+def handle_error(exception_context):
+    started = exception_context.connection.info.get('query_started') if exception_context.connection else None
+    if started:
+        started.pop()
+    count('sql.errors')
+
+
+def instrument_engine(db_engine):
+    """
+    Counts the queries of a sqlalchemy engine and records their latency per statement kind (SELECT, INSERT, ...).
+    :param db_engine: sqlalchemy.engine.Engine
+    """
+    sqlalchemy.event.listen(db_engine, 'before_cursor_execute', before_cursor_execute)
+    sqlalchemy.event.listen(db_engine, 'after_cursor_execute', after_cursor_execute)
+    sqlalchemy.event.listen(db_engine, 'handle_error', handle_error)
@@ -0,0 +1,106 @@
+import pandas as pd
+
+# columns of a kraken ledger export, used for the interface check:
+required_columns = ["txid", "refid", "time", "type", "subtype", "aclass", "asset", "amount", "fee", "balance"]
+# columns actually parsed:
+parsed_columns = ['time', 'type', 'subtype', 'asset', 'amount']
+parsed_dtypes = {'type': 'category', 'subtype': 'category', 'asset': 'category', 'amount': 'float64'}
+chunksize = 100000
+# raised by pandas for files that are not a csv at all, e.g. empty, binary or in another encoding:
+csv_errors = (pd.errors.EmptyDataError, pd.errors.ParserError, UnicodeDecodeError)
+
+
+class LedgerFormatError(ValueError):
+    """Raised when an uploaded file is not a kraken ledger export."""
+
+    def __init__(self, message, missing_columns=()):
+        super().__init__(message)
+        self.missing_columns = list(missing_columns)
+
+
+def check_columns(file):
+    """
+    Reads only the header of the ledger and rewinds the file.
+    :param file: path or file like object of the kraken ledger csv
+    """
+    try:
+        columns = pd.read_csv(file, nrows=0).columns
+    except csv_errors as e:
+        raise LedgerFormatError(f"The file could not be read as a csv: {e}") from e
+    if hasattr(file, 'seek'):
+        file.seek(0)
+    missing_columns = [column for column in required_columns if column not in columns]
+    if missing_columns:
+        raise LedgerFormatError("Dataframe is missing the following columns: " + ', '.join(missing_columns) +
+                                ". These columns are required to process the data.", missing_columns)
+
+
+def read_staking_rows(file, chunksize=chunksize):
+    """
+    Streams the ledger in chunks and keeps only the staking rows, so memory scales with the number of rewards
+    instead of the number of ledger rows.
+    :param file: path or file like object of the kraken ledger csv
+    :param chunksize: ledger rows parsed at once
+    :return: pd.DataFrame with the columns time (datetime64), type, subtype, asset (categorical), amount (float64)
+    """
+    check_columns(file)
+    staking_chunks = []
+    try:
+        for chunk in pd.read_csv(file, usecols=parsed_columns, dtype=parsed_dtypes, chunksize=chunksize):
+            staking_chunks.append(chunk[chunk['type'].str.contains('staking', na=False).to_numpy(dtype=bool)])
+    # ValueError: e.g. an amount that is not a number
+    except (*csv_errors, ValueError) as e:
+        raise LedgerFormatError(f"The file could not be read as a kraken ledger: {e}") from e
+    if not staking_chunks:
+        raise LedgerFormatError("The ledger does not contain any rows.")
+    staking_df = pd.concat(staking_chunks, ignore_index=True)
+    # categories of the chunks differ, unify them once on the (small) filtered frame:
+    for column in ('type', 'subtype', 'asset'):
+        staking_df[column] = staking_df[column].astype(object).astype('category')
+    try:
+        staking_df['time'] = pd.to_datetime(staking_df['time'])
+    except ValueError as e:
+        raise LedgerFormatError("An error occurred while trying to parse the 'time' column.") from e
+    return staking_df
+
+
+def pivot_rewards(staking_df):
+    """
+    :param staking_df: pd.DataFrame as returned by read_staking_rows
+    :return: pd.DataFrame indexed by time with the summed reward amount per asset, NaN where nothing was received
+    """
+    amounts = staking_df.groupby(['time', 'asset'], observed=True)['amount'].sum()
+    rewards_df = amounts.unstack('asset')
+    rewards_df.columns = rewards_df.columns.astype(str)
+    rewards_df.columns.name = 'asset'
+    return rewards_df.sort_index(axis=1)
+
+
+def read_rewards(file, chunksize=chunksize):
+    """
+    :param file: path or file like object of the kraken ledger csv
+    :param chunksize: ledger rows parsed at once
+    :return: (rewards_df, staking_df)
+    """
+    staking_df = read_staking_rows(file, chunksize)
+    return pivot_rewards(staking_df), staking_df
+
+
+def get_reward_assets(rewards_df):
+    """
+    :param rewards_df: pd.DataFrame as returned by pivot_rewards
+    :return: list of str, all columns which include staking rewards (['SOL.S', 'DOT.S'])
+    """
+    return [col for col in rewards_df.columns if '.S' in col]
+
+
+def select_period(rewards_df, start_date, end_date):
+    """
+    Cuts the rewards before start_date because the database will only contain prices later than start_date.
+    :param rewards_df: pd.DataFrame as returned by pivot_rewards
+    :param start_date: datetime.date
+    :param end_date: datetime.date
+    :return: pd.DataFrame
+    """
+    mask_rew = (rewards_df.index >= pd.to_datetime(start_date)) & (rewards_df.index <= pd.to_datetime(end_date))
+    return rewards_df[mask_rew]
@@ -0,0 +1,109 @@
+import hashlib
+import os
+import pathlib
+import tempfile
+import pandas as pd
+
+root_dir0 = pathlib.Path(__file__).resolve().parents[0]
+cache_dir = pathlib.Path.joinpath(root_dir0, '.ledger_cache')
+# the least recently used entries are deleted once the directory grows beyond this size:
+max_cache_bytes = 256 * 1024 ** 2
+
+
+def file_hash(file, block_size=1024 ** 2):
+    """
+    :param file: path or file like object, file like objects are rewound afterwards
+    :param block_size: bytes hashed at once
+    :return: str, sha256 hex digest of the file content
+    """
+    sha256 = hashlib.sha256()
+    if isinstance(file, (str, os.PathLike)):
+        with open(file, 'rb') as f:
+            for block in iter(lambda: f.read(block_size), b''):
+                sha256.update(block)
+    else:
+        file.seek(0)
+        for block in iter(lambda: file.read(block_size), b''):
+            sha256.update(block if isinstance(block, bytes) else block.encode())
+        file.seek(0)
+    return sha256.hexdigest()
+
+
+def make_key(*parts):
+    """
+    :param parts: everything the cached result depends on, e.g. file hash, base currency, date range
+    :return: str
+    """
+    return hashlib.sha256('|'.join(str(part) for part in parts).encode()).hexdigest()
+
+
+def frame_path(key, name):
+    return pathlib.Path.joinpath(cache_dir, f"{key}.{name}.parquet")
+
+
+def load_frames(key, names):
+    """
+    :param key: str as returned by make_key
+    :param names: list of str, frames stored under the key
+    :return: dict name -> pd.DataFrame or None if any frame is not cached
+    """
+    paths = {name: frame_path(key, name) for name in names}
+    try:
+        frames = {name: pd.read_parquet(path) for name, path in paths.items()}
+        # mark as recently used for cleanup:
+        for path in paths.values():
+            os.utime(path)
+    # OSError: e.g. deleted by the cleanup of another session in between
+    except (FileNotFoundError, OSError):
+        return None
+    return frames
+
+
+def store_frames(key, frames):
+    """
+    :param key: str as returned by make_key
+    :param frames: dict name -> pd.DataFrame
+    """
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    for name, df in frames.items():
+        path = frame_path(key, name)
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=cache_dir)
+        os.close(fd)
+        try:
+            df.to_parquet(tmp_path)
+            # readers of a concurrent session never see a half written file:
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    cleanup()
+
+
+def cleanup(max_bytes=None):
+    """
+    Deletes the least recently used cache files until the cache directory is smaller than max_bytes.
+    :param max_bytes: defaults to max_cache_bytes
+    """
+    if max_bytes is None:
+        max_bytes = max_cache_bytes
+    if not cache_dir.exists():
+        return
+    files = []
+    for path in cache_dir.glob('*.parquet'):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            # deleted by the cleanup of another session:
+            continue
+        files.append((stat.st_mtime, stat.st_size, path))
+    files.sort()
+    total_bytes = sum(size for _, size, _ in files)
+    for _, size, path in files:
+        if total_bytes <= max_bytes:
+            break
+        path.unlink(missing_ok=True)
+        total_bytes -= size
+
+
+def clear():
+    cleanup(max_bytes=0)
@@ -0,0 +1,115 @@
+import collections
+import hashlib
+import html as html_lib
+import pathlib
+import tempfile
+import threading
+
+# generated reports kept in memory, keyed by report_key:
+max_cached_reports = 8
+# wkhtmltopdf refuses to load local image files without enable-local-file-access:
+default_options = {'enable-local-file-access': None, 'quiet': '', 'encoding': 'UTF-8'}
+
+report_cache = collections.OrderedDict()
+report_cache_lock = threading.Lock()
+
+report_template = """<html>
+    <head>
+        <meta http-equiv="Content-Type" content="text/html; charset=utf-8">
+        <title>{title}</title>
+    </head>
+    <body>
+{body}
+    </body>
+</html>
+"""
+
+
+def report_section(title, image, table=None, text='', image_format='png'):
+    """
+    :param title: str, subheader of the section
+    :param image: bytes of the chart image
+    :param table: pd.DataFrame shown below the chart or None
+    :param text: str, html paragraph content shown below the table
+    :param image_format: 'png' or 'svg'
+    :return: dict, one section of a report
+    """
+    return {'title': title, 'image': image, 'table': table, 'text': text, 'image_format': image_format}
+
+
+def report_key(sections, title, options):
+    """
+    :return: str, hash of everything the generated pdf depends on
+    """
+    sha256 = hashlib.sha256(title.encode())
+    sha256.update(repr(sorted(options.items())).encode())
+    for section in sections:
+        sha256.update(section['title'].encode())
+        sha256.update(section['image_format'].encode())
+        sha256.update(hashlib.sha256(section['image']).digest())
+        sha256.update(section['text'].encode())
+        if section['table'] is not None:
+            sha256.update(section['table'].to_csv().encode())
+    return sha256.hexdigest()
+
+
+def build_report_html(sections, image_dir, title="Kraken Staking Report"):
+    """
+    Writes the section images into image_dir and returns the report html referencing them by file url,
+    so the html stays small instead of inlining every image as base64.
+    :param sections: list of dicts as returned by report_section
+    :param image_dir: pathlib.Path of an existing directory
+    :param title: str
+    :return: str
+    """
+    body = []
+    for i, section in enumerate(sections):
+        image_path = pathlib.Path.joinpath(image_dir, f"chart_{i}.{section['image_format']}")
+        image_path.write_bytes(section['image'])
+        body.append(f'<h3 style="padding: 0px; margin: 0px;">{html_lib.escape(section["title"])}</h3>')
+        body.append(f'<img style="padding: 0px; margin: 0px;" src="{image_path.as_uri()}" width="900">')
+        if section['table'] is not None:
+            body.append(section['table'].to_html())
+        body.append(f'<p style="padding: 0; margin: 0;">{section["text"]}</p>')
+    return report_template.format(title=html_lib.escape(title), body='\n'.join(body))
+
+
+def wkhtmltopdf_renderer(html, options):
+    """
+    :return: bytes of the pdf rendered by wkhtmltopdf
+    """
+    # only imported when a report is produced:
+    import pdfkit
+    # output_path False: pdfkit returns the pdf instead of writing a file
+    return pdfkit.from_string(html, False, options=options)
+
+
+def generate_report(sections, title="Kraken Staking Report", renderer=None, options=None):
+    """
+    Renders the report sections to a pdf. Unchanged reports are served from memory instead of rendered again.
+    :param sections: list of dicts as returned by report_section
+    :param title: str
+    :param renderer: callable(html, options) -> bytes, defaults to wkhtmltopdf through pdfkit
+    :param options: dict of wkhtmltopdf options, defaults to default_options
+    :return: bytes of the pdf, e.g. for a download button
+    """
+    if renderer is None:
+        renderer = wkhtmltopdf_renderer
+    if options is None:
+        options = default_options
+    key = report_key(sections, title, options)
+    with report_cache_lock:
+        if key in report_cache:
+            report_cache.move_to_end(key)
+            return report_cache[key]
+
+    # images only have to exist while the renderer runs:
+    with tempfile.TemporaryDirectory() as image_dir:
+        html = build_report_html(sections, pathlib.Path(image_dir), title)
+        pdf = renderer(html, options)
+
+    with report_cache_lock:
+        report_cache[key] = pdf
+        while len(report_cache) > max_cached_reports:
+            report_cache.popitem(last=False)
+    return pdf
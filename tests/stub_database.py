@@ -0,0 +1,35 @@
+import contextlib
+import os
+import tempfile
+import unittest
+import benchmarks.kraken_stub as kraken_stub
+
+# 2023-01-01:
+bars_end = 1672531200
+
+
+class StubDatabaseTestCase(unittest.TestCase):
+    """
+    Runs every test against a kraken stub serving the bars from bars_start to bars_end and a temporary database.
+    """
+    bars_start = bars_end - 99 * 86400
+    bars_end = bars_end
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = kraken_stub.KrakenStubServer(bars_start=cls.bars_start, bars_end=cls.bars_end).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.exit_stack = contextlib.ExitStack()
+        self.exit_stack.enter_context(
+            kraken_stub.connect(self.server, 'sqlite:///' + os.path.join(self.tmp_dir.name, 'test.db')))
+
+    def tearDown(self):
+        self.exit_stack.close()
+        self.tmp_dir.cleanup()
@@ -0,0 +1,103 @@
+import contextlib
+import io
+import os
+import pathlib
+import tempfile
+import unittest
+import pandas as pd
+import batch
+import benchmarks.kraken_stub as kraken_stub
+import data_requests
+import ledger_cache
+from test_ledger import ledger_csv
+
+
+class TestBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.tmp_path = pathlib.Path(self.tmp_dir.name)
+        self.cache_dir = ledger_cache.cache_dir
+        self.db_file = self.tmp_path / 'prices.db'
+        data_requests.use_database('sqlite:///' + str(self.db_file))
+        timestamps = [1672531200 + day * 86400 for day in range(3)]
+        for ticker in ('SOLEUR', 'DOTEUR'):
+            bars = pd.DataFrame({'timestamp': timestamps, 'open': 1.0, 'high': 2.0, 'low': 0.5,
+                                 'close': [10.0, 20.0, 30.0], 'vwap': 1.0, 'volume': 3.0, 'count': 4})
+            data_requests.upsert_ohlc(ticker, bars, timestamps[0], timestamps[-1])
+        self.ledger_dir = self.tmp_path / 'ledgers'
+        self.ledger_dir.mkdir()
+        for account in ('alice', 'bob'):
+            (self.ledger_dir / f'{account}.csv').write_text(ledger_csv)
+
+    def tearDown(self):
+        ledger_cache.cache_dir = self.cache_dir
+        data_requests.use_database(data_requests.db_path)
+        self.tmp_dir.cleanup()
+
+    def test_main(self):
+        output_dir = self.tmp_path / 'reports'
+        exit_code = batch.main([str(self.ledger_dir), str(output_dir), '--workers', '2',
+                                '--start-date', '2022-12-01', '--end-date', '2023-01-31',
+                                '--database', str(self.db_file), '--cache-dir', str(self.tmp_path / 'cache')])
+        self.assertEqual(exit_code, 0)
+        for account in ('alice', 'bob'):
+            for table in ('rewards.csv', 'accumulated.csv', 'summary.csv'):
+                self.assertTrue(os.path.exists(output_dir / account / table))
+        summary_df = pd.read_csv(output_dir / 'summary.csv', index_col=['account', 'asset'])
+        self.assertAlmostEqual(summary_df.loc[('alice', 'SOL.S'), 'total_reward'], 0.06)
+        # 0.06 SOL at 30 EUR:
+        self.assertAlmostEqual(summary_df.loc[('bob', 'SOL.S'), 'worth_last'], 1.8)
+        # 0.03 SOL at 10 EUR + 0.03 SOL at 30 EUR:
+        self.assertAlmostEqual(summary_df.loc[('bob', 'SOL.S'), 'worth_on_continuous_sale'], 1.2)
+
+    def test_missing_prices(self):
+        exit_code = batch.main([str(self.ledger_dir), str(self.tmp_path / 'reports'), '--workers', '1',
+                                '--base-currency', 'USD', '--start-date', '2022-12-01', '--end-date', '2023-01-31',
+                                '--database', str(self.db_file), '--cache-dir', str(self.tmp_path / 'cache')])
+        self.assertEqual(exit_code, 1)
+
+    def test_unreadable_ledgers(self):
+        (self.ledger_dir / 'empty.csv').write_bytes(b'')
+        (self.ledger_dir / 'binary.csv').write_bytes(bytes(range(256)) * 4)
+        output_dir = self.tmp_path / 'reports'
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr):
+            exit_code = batch.main([str(self.ledger_dir), str(output_dir), '--workers', '1',
+                                    '--start-date', '2022-12-01', '--end-date', '2023-01-31',
+                                    '--database', str(self.db_file), '--cache-dir', str(self.tmp_path / 'cache')])
+        self.assertEqual(exit_code, 1)
+        self.assertIn('empty.csv: ', stderr.getvalue())
+        self.assertIn('binary.csv: ', stderr.getvalue())
+        summary_df = pd.read_csv(output_dir / 'summary.csv', index_col=['account', 'asset'])
+        self.assertEqual(sorted(set(summary_df.index.get_level_values('account'))), ['alice', 'bob'])
+
+    def test_update_skips_malformed_ledger(self):
+        (self.ledger_dir / 'junk.csv').write_text('foo,bar\n')
+        (self.ledger_dir / 'empty.csv').write_bytes(b'')
+        output_dir = self.tmp_path / 'reports'
+        server = kraken_stub.KrakenStubServer(bars_start=1669680000, bars_end=1672790400).start()
+        stderr = io.StringIO()
+        try:
+            with kraken_stub.connect(server, 'sqlite:///' + str(self.db_file)), contextlib.redirect_stderr(stderr):
+                exit_code = batch.main([str(self.ledger_dir), str(output_dir), '--workers', '1', '--update',
+                                        '--start-date', '2022-12-01', '--end-date', '2023-01-31',
+                                        '--database', str(self.db_file),
+                                        '--cache-dir', str(self.tmp_path / 'cache')])
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertEqual(exit_code, 1)
+        # reported once, the other accounts are processed:
+        self.assertEqual(stderr.getvalue().count('junk.csv: '), 1)
+        self.assertEqual(stderr.getvalue().count('empty.csv: '), 1)
+        self.assertNotIn('Update of', stderr.getvalue())
+        summary_df = pd.read_csv(output_dir / 'summary.csv', index_col=['account', 'asset'])
+        self.assertEqual(sorted(set(summary_df.index.get_level_values('account'))), ['alice', 'bob'])
+        # the prices of the readable ledgers were updated:
+        data_requests.use_database('sqlite:///' + str(self.db_file))
+        self.assertIsNotNone(data_requests.get_sync_state('SOLUSD'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+import unittest
+import numpy as np
+import pandas as pd
+import charts
+import valuation
+from test_valuation import price_loader
+
+
+class TestCharts(unittest.TestCase):
+
+    def setUp(self):
+        charts.chart_cache.clear()
+        index = pd.to_datetime(['2023-01-01 01:00:00', '2023-01-02 02:00:00', '2023-01-03 03:00:00'])
+        rewards_df = pd.DataFrame({'SOL.S': [1.0, np.nan, 2.0], 'DOT.S': [np.nan, 4.0, 1.0]}, index=index)
+        rewards_df, df_accumulated = valuation.value_rewards(rewards_df, ['SOL.S', 'DOT.S'], 'EUR', 'close',
+                                                             price_loader)
+        self.asset_charts = [(asset, 'EUR', charts.asset_chart_data(rewards_df, df_accumulated, asset, 'EUR'))
+                             for asset in ('SOL.S', 'DOT.S')]
+
+    def test_summary_table(self):
+        summary_df = charts.summary_table(self.asset_charts[0][2])
+        self.assertEqual(list(summary_df.columns), ['SOL.S', 'SOL.S_EUR', 'SOL.S_EUR_ONREC'])
+        self.assertEqual(len(summary_df), 2)
+
+    def test_render_charts_cached(self):
+        images = charts.render_charts(self.asset_charts, dpi=50, parallel=False)
+        self.assertEqual(len(images), 2)
+        self.assertTrue(all(image.startswith(b'\x89PNG') for image in images))
+        self.assertEqual(len(charts.chart_cache), 2)
+        self.assertEqual(charts.render_charts(self.asset_charts[::-1], dpi=50, parallel=False), images[::-1])
+        self.assertEqual(len(charts.chart_cache), 2)
+
+    def test_render_charts_parallel(self):
+        parallel_threshold = charts.parallel_threshold
+        charts.parallel_threshold = 1
+        try:
+            images = charts.render_charts(self.asset_charts, dpi=50)
+        finally:
+            charts.parallel_threshold = parallel_threshold
+        self.assertEqual(images[0], charts.render_asset_chart(*self.asset_charts[0], dpi=50))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,13 @@
+import os
 import sqlite3
+import tempfile
+import time
 import unittest
 import data_requests
+import instrumentation
 import pandas as pd
+import sqlalchemy
+from stub_database import StubDatabaseTestCase
 
 
 class TestKrakenModule(unittest.TestCase):
@@ -36,6 +42,293 @@ class TestKrakenModule(unittest.TestCase):
         print(data_requests.add_list_of_ohlc(ticker_list, start))
 
 
+class TestOHLCSync(StubDatabaseTestCase):
+
+    def test_incremental_sync(self):
+        start = self.server.bars_end - 50 * 86400
+        self.assertEqual(data_requests.add_ohlc('SOLEUR', start), 50)
+        self.server.bars_end += 2 * 86400
+        # only the open bar of the first sync and the two new bars are downloaded again:
+        self.assertEqual(data_requests.add_ohlc('SOLEUR', start), 3)
+        self.assertEqual(self.server.requests[-1], ('SOLEUR', self.server.bars_end - 3 * 86400))
+        df = data_requests.get_ohlc_from_db('SOLEUR')
+        self.assertEqual(len(df), 52)
+        self.assertTrue(df['timestamp'].is_unique)
+        sync_state = data_requests.get_sync_state('SOLEUR')
+        self.assertEqual(sync_state['start'], start)
+        self.assertEqual(sync_state['max_timestamp'], self.server.bars_end)
+
+    def test_sync_pages_through_limit(self):
+        self.server.page_size = 10
+        max_bars_per_request = data_requests.max_bars_per_request
+        data_requests.max_bars_per_request = 10
+        try:
+            data_requests.add_ohlc('DOTEUR', self.server.bars_end - 35 * 86400)
+        finally:
+            data_requests.max_bars_per_request = max_bars_per_request
+        self.assertEqual(len(self.server.requests), 4)
+        self.assertEqual(len(data_requests.get_ohlc_from_db('DOTEUR')), 35)
+
+    def test_backfill_earlier_start(self):
+        data_requests.add_ohlc('ADAEUR', self.server.bars_end - 10 * 86400)
+        data_requests.add_ohlc('ADAEUR', self.server.bars_end - 20 * 86400)
+        self.assertEqual(self.server.requests[-1], ('ADAEUR', self.server.bars_end - 20 * 86400))
+        self.assertEqual(len(data_requests.get_ohlc_from_db('ADAEUR')), 20)
+
+    def test_concurrent_list_sync(self):
+        ticker_list = ['SOLEUR', 'DOTEUR', 'ADAEUR', 'KSMEUR', 'FLOWEUR']
+        report = data_requests.add_list_of_ohlc(ticker_list, self.server.bars_end - 30 * 86400, max_workers=3)
+        self.assertEqual(sorted(report), sorted(ticker_list))
+        for ticker in ticker_list:
+            self.assertEqual(report[ticker]['bars'], 30)
+            self.assertGreater(report[ticker]['latency'], 0)
+            self.assertEqual(len(data_requests.get_ohlc_from_db(ticker)), 30)
+
+    def test_retry_on_rate_limit(self):
+        retry_backoff = data_requests.retry_backoff
+        data_requests.retry_backoff = 0.01
+        self.server.rate_limited = 2
+        try:
+            report = data_requests.add_list_of_ohlc(['SOLEUR'], self.server.bars_end - 5 * 86400)
+        finally:
+            data_requests.retry_backoff = retry_backoff
+        self.assertEqual(report['SOLEUR']['bars'], 5)
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_error_is_reported(self):
+        retry_backoff = data_requests.retry_backoff
+        data_requests.retry_backoff = 0.01
+        self.server.rate_limited = data_requests.max_retries + 1
+        try:
+            report = data_requests.add_list_of_ohlc(['SOLEUR'], self.server.bars_end - 5 * 86400)
+        finally:
+            data_requests.retry_backoff = retry_backoff
+        self.assertIn('Rate limit', report['SOLEUR']['error'])
+
+    def test_write_error_is_reported(self):
+        with data_requests.database.begin() as connection:
+            connection.execute(sqlalchemy.sql.text(
+                f"CREATE TRIGGER fail_doteur BEFORE INSERT ON {data_requests.ohlc_table_name} "
+                f"WHEN NEW.pair = 'DOTEUR' BEGIN SELECT RAISE(ABORT, 'disk I/O error'); END"))
+        report = data_requests.add_list_of_ohlc(['SOLEUR', 'DOTEUR', 'ADAEUR'], self.server.bars_end - 5 * 86400)
+        self.assertIn('disk I/O error', report['DOTEUR']['error'])
+        self.assertEqual(report['SOLEUR']['bars'], 5)
+        self.assertEqual(report['ADAEUR']['bars'], 5)
+        self.assertIsNone(data_requests.get_sync_state('DOTEUR'))
+
+    def test_sync_intervals(self):
+        start = self.server.bars_end - 3 * 86400
+        report = data_requests.sync_list_of_ohlc(['SOLEUR'], start, intervals=(60, 1440))
+        # 72 hourly and 3 daily bars after start:
+        self.assertEqual(report['SOLEUR']['bars'], 75)
+        self.assertEqual(len(data_requests.get_ohlc_from_db('SOLEUR', interval=60)), 72)
+        self.assertEqual(len(data_requests.get_ohlc_from_db('SOLEUR', interval=1440)), 3)
+        self.assertGreater(data_requests.sync_generation(['SOLEUR'], 60), 0)
+
+
+class TestOHLCStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.tmp_dir.name, 'test.db')
+
+    def tearDown(self):
+        data_requests.use_database(data_requests.db_path)
+        self.tmp_dir.cleanup()
+
+    def bars(self, ticker, timestamps):
+        return pd.DataFrame({'timestamp': timestamps, 'open': 1.0, 'high': 2.0, 'low': 0.5,
+                             'close': [float(i) for i in range(len(timestamps))], 'vwap': 1.0, 'volume': 3.0,
+                             'count': 4, 'ticker': ticker})
+
+    def test_migrate_legacy_tables(self):
+        # old layout: one untyped table per ticker, timestamps stored as text
+        with sqlite3.connect(self.db_file) as legacy:
+            self.bars('SOLEUR', ['1672531200', '1672617600']).to_sql('SOLEUR', legacy, index=False)
+        data_requests.use_database('sqlite:///' + self.db_file)
+        df = data_requests.get_ohlc_from_db('SOLEUR')
+        self.assertEqual(list(df['timestamp']), [1672531200, 1672617600])
+        self.assertEqual(df['ticker'][0], 'SOLEUR')
+        with sqlite3.connect(self.db_file) as db:
+            tables = {row[0] for row in db.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            journal_mode = db.execute("PRAGMA journal_mode").fetchone()[0]
+        self.assertNotIn('SOLEUR', tables)
+        self.assertEqual(journal_mode, 'wal')
+
+    def test_sync_generation(self):
+        data_requests.use_database('sqlite:///' + self.db_file)
+        data_requests.upsert_ohlc('SOLEUR', self.bars('SOLEUR', [1672531200]), 1672531200, 1672531200)
+        first = data_requests.sync_generation(['SOLEUR', 'DOTEUR'])
+        # a second write within the same second still changes the key of both tickers:
+        data_requests.upsert_ohlc('DOTEUR', self.bars('DOTEUR', [1672531200]), 1672531200, 1672531200)
+        second = data_requests.sync_generation(['SOLEUR', 'DOTEUR'])
+        self.assertGreater(second, first)
+        data_requests.upsert_ohlc('SOLEUR', self.bars('SOLEUR', [1672617600]), 1672531200, 1672617600)
+        self.assertGreater(data_requests.sync_generation(['SOLEUR', 'DOTEUR']), second)
+        self.assertEqual(data_requests.sync_generation(['DOTEUR']), second)
+
+    def test_add_generation_column(self):
+        with sqlite3.connect(self.db_file) as db:
+            db.execute(f"CREATE TABLE {data_requests.sync_table_name} (pair TEXT NOT NULL, interval INTEGER NOT NULL, "
+                       f"start INTEGER, last INTEGER, min_timestamp INTEGER, max_timestamp INTEGER, "
+                       f"synced_at INTEGER, PRIMARY KEY (pair, interval))")
+            db.execute(f"INSERT INTO {data_requests.sync_table_name} VALUES ('SOLEUR', 1440, 0, 0, 0, 0, 0)")
+        data_requests.use_database('sqlite:///' + self.db_file)
+        self.assertEqual(data_requests.sync_generation(['SOLEUR']), 0)
+        data_requests.upsert_ohlc('SOLEUR', self.bars('SOLEUR', [1672531200]), 1672531200, 1672531200)
+        self.assertEqual(data_requests.sync_generation(['SOLEUR']), 1)
+
+    def test_lazy_database(self):
+        data_requests.use_database('sqlite:///' + self.db_file)
+        # nothing is opened before the first query:
+        self.assertFalse(os.path.exists(self.db_file))
+        self.assertIsNone(data_requests.database.engine)
+        self.assertEqual(data_requests.sync_generation(['SOLEUR']), 0)
+        self.assertTrue(os.path.exists(self.db_file))
+        data_requests.close_db_connection()
+        self.assertIsNone(data_requests.database.engine)
+        # reopened on the next use:
+        data_requests.upsert_ohlc('SOLEUR', self.bars('SOLEUR', [1672531200]), 1672531200, 1672531200)
+        self.assertEqual(len(data_requests.get_ohlc_from_db('SOLEUR')), 1)
+
+    def test_point_and_range_lookup(self):
+        data_requests.use_database('sqlite:///' + self.db_file)
+        timestamps = [1672531200 + day * 86400 for day in range(10)]
+        data_requests.upsert_ohlc('SOLEUR', self.bars('SOLEUR', timestamps), timestamps[0], timestamps[-1])
+        data_requests.upsert_ohlc('DOTEUR', self.bars('DOTEUR', timestamps), timestamps[0], timestamps[-1])
+        df = data_requests.get_ticker_from_db('SOLEUR', float(timestamps[3]))
+        self.assertEqual(df['close'][0], 3.0)
+        df = data_requests.get_ohlc_range_from_db(['SOLEUR', 'DOTEUR'], timestamps[2], timestamps[5])
+        self.assertEqual(len(df), 8)
+        self.assertEqual(set(df['ticker']), {'SOLEUR', 'DOTEUR'})
+        self.assertTrue(data_requests.get_ohlc_from_db('ADAEUR').empty)
+
+    def test_price_cache(self):
+        data_requests.use_database('sqlite:///' + self.db_file)
+        timestamps = [1672531200 + day * 86400 for day in range(10)]
+        data_requests.upsert_ohlc('SOLEUR', self.bars('SOLEUR', timestamps[:5]), timestamps[0], timestamps[4])
+        info = data_requests.price_cache_info()
+        self.assertEqual(len(data_requests.get_ohlc_from_db('SOLEUR')), 5)
+        df = data_requests.get_ohlc_from_db('SOLEUR')
+        self.assertEqual(list(df['close']), [0.0, 1.0, 2.0, 3.0, 4.0])
+        self.assertEqual(df['ticker'][0], 'SOLEUR')
+        self.assertEqual(data_requests.price_cache_info()['hits'], info['hits'] + 1)
+        self.assertEqual(data_requests.price_cache_info()['misses'], info['misses'] + 1)
+        # a sync of new rows invalidates the cached frames of the ticker:
+        data_requests.upsert_ohlc('SOLEUR', self.bars('SOLEUR', timestamps), timestamps[0], timestamps[-1])
+        self.assertEqual(len(data_requests.get_ohlc_from_db('SOLEUR')), 10)
+
+    def test_resample_ohlc(self):
+        # two complete 4h buckets of hourly bars and an incomplete one:
+        df = self.bars('SOLEUR', [1672531200 + hour * 3600 for hour in range(10)])
+        df['high'] = range(10)
+        df.loc[4:, 'volume'] = 0.0
+        df.loc[4:, 'vwap'] = [2.0, 4.0, 6.0, 8.0, 1.0, 1.0]
+        bars = data_requests.resample_ohlc(df, 240, 60)
+        self.assertEqual(list(bars['timestamp']), [1672531200, 1672545600])
+        self.assertEqual(list(bars['close']), [3.0, 7.0])
+        self.assertEqual(list(bars['high']), [3.0, 7.0])
+        self.assertEqual(list(bars['volume']), [12.0, 0.0])
+        self.assertEqual(list(bars['count']), [16, 16])
+        # volume weighted, the mean without volume:
+        self.assertEqual(list(bars['vwap']), [1.0, 5.0])
+
+    def test_derived_bars(self):
+        data_requests.use_database('sqlite:///' + self.db_file)
+        day = 86400
+        start = 1672531200
+        # daily bars of the first two days, hourly bars of the second and third day:
+        data_requests.upsert_ohlc('SOLEUR', self.bars('SOLEUR', [start, start + day]), start, start + day)
+        hours = [start + day + hour * 3600 for hour in range(48)]
+        data_requests.upsert_ohlc('SOLEUR', self.bars('SOLEUR', hours), hours[0], hours[-1], interval=60)
+        df = data_requests.get_ohlc_from_db('SOLEUR', start, start + 2 * day)
+        self.assertEqual(list(df['timestamp']), [start, start + day, start + 2 * day])
+        # stored daily bars win over derived ones:
+        self.assertEqual(list(df['close']), [0.0, 1.0, 47.0])
+        self.assertEqual(df['ticker'][2], 'SOLEUR')
+        # 4h bars are not stored at all:
+        self.assertEqual(len(data_requests.get_ohlc_from_db('SOLEUR', interval=240)), 12)
+
+    def test_derived_bars_read_only_missing_buckets(self):
+        data_requests.use_database('sqlite:///' + self.db_file)
+        day = 86400
+        start = 1672531200
+        # hourly bars of ten days, daily bars of the first eight and the tenth day:
+        hours = [start + hour * 3600 for hour in range(240)]
+        data_requests.upsert_ohlc('SOLEUR', self.bars('SOLEUR', hours), hours[0], hours[-1], interval=60)
+        days = [start + i * day for i in range(8)] + [start + 9 * day]
+        data_requests.upsert_ohlc('SOLEUR', self.bars('SOLEUR', days), days[0], days[-1])
+        with instrumentation.capture() as metrics:
+            df = data_requests.get_ohlc_from_db('SOLEUR')
+        self.assertEqual(list(df['timestamp']), [start + i * day for i in range(10)])
+        # the ninth day is derived, from the hourly bars after the stored contiguous days only:
+        self.assertEqual(df['close'][8], 215.0)
+        self.assertEqual(metrics.snapshot()['counters']['ohlc.source_bars'], 48)
+        # a short range reads the finer bars of its buckets:
+        with instrumentation.capture() as metrics:
+            df = data_requests.get_ohlc_from_db('SOLEUR', start + 8 * day, start + 8 * day + 7200)
+        self.assertEqual(list(df['timestamp']), [start + 8 * day])
+        self.assertEqual(metrics.snapshot()['counters']['ohlc.source_bars'], 24)
+
+    def test_price_cache_eviction(self):
+        cache = data_requests.PriceCache(max_bytes=3 * 8 * 8 * 10)
+        for day in range(4):
+            cache.put(('SOLEUR', 1440, day, None), self.bars('SOLEUR', list(range(10))))
+        self.assertEqual(cache.info()['entries'], 3)
+        self.assertIsNone(cache.get(('SOLEUR', 1440, 0, None)))
+        self.assertIsNotNone(cache.get(('SOLEUR', 1440, 3, None)))
+
+    def test_price_cache_sees_writes_of_other_connections(self):
+        data_requests.use_database('sqlite:///' + self.db_file)
+        self.assertTrue(data_requests.get_ohlc_from_db('SOLEUR').empty)
+        # another process writes to the same file, this process' cache is not invalidated:
+        other_engine = data_requests.create_db_engine('sqlite:///' + self.db_file)
+        try:
+            with other_engine.begin() as connection:
+                connection.execute(sqlalchemy.sql.text(
+                    f"INSERT INTO {data_requests.ohlc_table_name} "
+                    f"VALUES ('SOLEUR', 1440, 1672531200, 10.0, 10.0, 10.0, 10.0, 10.0, 1.0, 1)"))
+                data_requests.set_sync_state(connection, 'SOLEUR', 1440, 1672531200, 1672531200)
+        finally:
+            other_engine.dispose()
+        df = data_requests.get_ohlc_from_db('SOLEUR')
+        self.assertEqual(list(df['close']), [10.0])
+        # served from the cache again until the next write:
+        info = data_requests.price_cache_info()
+        data_requests.get_ohlc_from_db('SOLEUR')
+        self.assertEqual(data_requests.price_cache_info()['hits'], info['hits'] + 1)
+
+    def test_price_cache_skips_stale_read(self):
+        cache = data_requests.PriceCache()
+        key = ('SOLEUR', 1440, None, None)
+        generation = cache.generation('SOLEUR')
+        # a sync of the ticker commits while the rows are read:
+        cache.invalidate('SOLEUR')
+        arrays = cache.put(key, self.bars('SOLEUR', [1672531200]), generation)
+        self.assertEqual(list(arrays['timestamp']), [1672531200])
+        self.assertIsNone(cache.get(key))
+        # reads of other tickers are still cached:
+        generation = cache.generation('DOTEUR')
+        cache.invalidate('SOLEUR')
+        cache.put(('DOTEUR', 1440, None, None), self.bars('DOTEUR', [1672531200]), generation)
+        self.assertIsNotNone(cache.get(('DOTEUR', 1440, None, None)))
+        # an invalidation of everything affects every ticker:
+        generation = cache.generation('SOLEUR')
+        cache.invalidate()
+        cache.put(key, self.bars('SOLEUR', [1672531200]), generation)
+        self.assertIsNone(cache.get(key))
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def test_rate(self):
+        bucket = data_requests.TokenBucket(rate=50, capacity=1)
+        started = time.monotonic()
+        for _ in range(6):
+            bucket.acquire()
+        # first token is available immediately, the other five are refilled at 50 per second:
+        self.assertGreaterEqual(time.monotonic() - started, 0.09)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,89 @@
+import json
+import pathlib
+import tempfile
+import unittest
+import numpy as np
+import sqlalchemy
+import instrumentation
+
+
+class TestInstrumentation(unittest.TestCase):
+
+    def test_histogram(self):
+        metrics = instrumentation.Metrics()
+        for seconds in (0.0001, 0.002, 0.003, 10.0):
+            metrics.observe('sql.SELECT', seconds)
+        histogram = metrics.snapshot()['histograms']['sql.SELECT']
+        self.assertEqual(histogram['count'], 4)
+        self.assertAlmostEqual(histogram['seconds'], 10.0051)
+        self.assertEqual(histogram['buckets']['<=0.0005s'], 1)
+        self.assertEqual(histogram['buckets']['<=0.005s'], 2)
+        self.assertEqual(histogram['buckets']['>5.0s'], 1)
+
+    def test_nested_stages_and_capture(self):
+        with instrumentation.capture() as captured:
+            with instrumentation.stage('outer'):
+                for _ in range(2):
+                    with instrumentation.stage('inner'):
+                        pass
+            instrumentation.count('http.requests', 3)
+        instrumentation.count('http.requests')
+        snapshot = captured.snapshot()
+        self.assertEqual(snapshot['stages']['inner']['count'], 2)
+        self.assertEqual(snapshot['stages']['outer']['count'], 1)
+        self.assertGreaterEqual(snapshot['stages']['outer']['seconds'], snapshot['stages']['inner']['seconds'])
+        self.assertIsNone(snapshot['stages']['outer']['peak_memory_bytes'])
+        self.assertEqual(snapshot['counters'], {'http.requests': 3})
+        self.assertIn('outer', instrumentation.metrics.snapshot()['stages'])
+
+    def test_peak_memory(self):
+        trace_memory = instrumentation.trace_memory
+        instrumentation.trace_memory = True
+        try:
+            with instrumentation.capture() as captured:
+                with instrumentation.stage('outer'):
+                    with instrumentation.stage('inner'):
+                        data = np.ones(1024 ** 2)
+                        del data
+        finally:
+            instrumentation.trace_memory = trace_memory
+            instrumentation.tracemalloc.stop()
+        stages = captured.snapshot()['stages']
+        self.assertGreaterEqual(stages['inner']['peak_memory_bytes'], 8 * 1024 ** 2)
+        # the peak of the inner stage counts for the outer stage as well:
+        self.assertGreaterEqual(stages['outer']['peak_memory_bytes'], stages['inner']['peak_memory_bytes'])
+
+    def test_sql_queries(self):
+        engine = sqlalchemy.create_engine('sqlite:///:memory:')
+        instrumentation.instrument_engine(engine)
+        with instrumentation.capture() as captured:
+            with engine.connect() as connection:
+                connection.execute(sqlalchemy.text("CREATE TABLE t (x INTEGER)"))
+                connection.execute(sqlalchemy.text("INSERT INTO t VALUES (1)"))
+                connection.execute(sqlalchemy.text("SELECT x FROM t")).fetchall()
+                with self.assertRaises(sqlalchemy.exc.OperationalError):
+                    connection.execute(sqlalchemy.text("SELECT y FROM missing"))
+        snapshot = captured.snapshot()
+        self.assertEqual(snapshot['counters']['sql.queries'], 3)
+        self.assertEqual(snapshot['counters']['sql.queries.SELECT'], 1)
+        self.assertEqual(snapshot['counters']['sql.errors'], 1)
+        self.assertEqual(snapshot['histograms']['sql.INSERT']['count'], 1)
+
+    def test_json_log(self):
+        json_log_path = instrumentation.json_log_path
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            instrumentation.json_log_path = pathlib.Path(tmp_dir, 'metrics.jsonl')
+            try:
+                with instrumentation.stage('valuation'):
+                    pass
+                instrumentation.log_event({'event': 'render', 'counters': {'sql.queries': 2}})
+            finally:
+                log_path, instrumentation.json_log_path = instrumentation.json_log_path, json_log_path
+            records = [json.loads(line) for line in log_path.read_text().splitlines()]
+        self.assertEqual([record['event'] for record in records], ['stage', 'render'])
+        self.assertEqual(records[0]['name'], 'valuation')
+        self.assertIn('time', records[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
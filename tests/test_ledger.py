@@ -0,0 +1,38 @@
+import io
+import unittest
+import numpy as np
+import pandas as pd
+import ledger
+
+ledger_csv = """"txid","refid","time","type","subtype","aclass","asset","amount","fee","balance"
+"L1","R1","2023-01-01 01:00:00","deposit","","currency","ZEUR",100.0000,0.0000,100.0000
+"L2","R2","2023-01-01 02:00:00","staking","","currency","SOL.S",0.0100000000,0.0000000000,0.0100000000
+"L3","R3","2023-01-01 02:00:00","staking","","currency","SOL.S",0.0200000000,0.0000000000,0.0300000000
+"L4","R4","2023-01-02 03:00:00","trade","","currency","ZEUR",-50.0000,0.1000,49.9000
+"L5","R5","2023-01-02 04:00:00","staking","","currency","DOT.S",0.5000000000,0.0000000000,0.5000000000
+"L6","R6","2023-01-03 05:00:00","staking","","currency","SOL.S",0.0300000000,0.0000000000,0.0600000000
+"""
+
+
+class TestLedger(unittest.TestCase):
+
+    def test_read_rewards(self):
+        rewards_df, staking_df = ledger.read_rewards(io.StringIO(ledger_csv), chunksize=2)
+        self.assertEqual(len(staking_df), 4)
+        self.assertEqual(staking_df['asset'].dtype, 'category')
+        self.assertEqual(staking_df['amount'].dtype, np.float64)
+        self.assertEqual(list(rewards_df.columns), ['DOT.S', 'SOL.S'])
+        self.assertEqual(list(rewards_df.index), list(pd.to_datetime(
+            ['2023-01-01 02:00:00', '2023-01-02 04:00:00', '2023-01-03 05:00:00'])))
+        self.assertAlmostEqual(rewards_df['SOL.S'].iloc[0], 0.03)
+        self.assertTrue(np.isnan(rewards_df['SOL.S'].iloc[1]))
+        self.assertEqual(ledger.get_reward_assets(rewards_df), ['DOT.S', 'SOL.S'])
+
+    def test_missing_columns(self):
+        with self.assertRaises(ledger.LedgerFormatError) as context:
+            ledger.read_rewards(io.StringIO('"txid","time","asset"\n"L1","2023-01-01","SOL.S"\n'))
+        self.assertIn('amount', context.exception.missing_columns)
+
+
+if __name__ == '__main__':
+    unittest.main()
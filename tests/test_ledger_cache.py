@@ -0,0 +1,61 @@
+import io
+import os
+import pathlib
+import tempfile
+import time
+import unittest
+import pandas as pd
+import ledger
+import ledger_cache
+from test_ledger import ledger_csv
+
+
+class TestLedgerCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache_dir = ledger_cache.cache_dir
+        ledger_cache.cache_dir = pathlib.Path(self.tmp_dir.name)
+
+    def tearDown(self):
+        ledger_cache.cache_dir = self.cache_dir
+        self.tmp_dir.cleanup()
+
+    def test_file_hash(self):
+        file = io.BytesIO(ledger_csv.encode())
+        file.read(10)
+        self.assertEqual(ledger_cache.file_hash(file), ledger_cache.file_hash(io.BytesIO(ledger_csv.encode())))
+        self.assertEqual(file.tell(), 0)
+        self.assertNotEqual(ledger_cache.file_hash(file), ledger_cache.file_hash(io.BytesIO(b'other')))
+
+    def test_round_trip(self):
+        rewards_df, staking_df = ledger.read_rewards(io.StringIO(ledger_csv))
+        key = ledger_cache.make_key('hash', 'EUR', 'close')
+        self.assertIsNone(ledger_cache.load_frames(key, ['rewards', 'staking']))
+        ledger_cache.store_frames(key, {'rewards': rewards_df, 'staking': staking_df})
+        frames = ledger_cache.load_frames(key, ['rewards', 'staking'])
+        pd.testing.assert_frame_equal(frames['rewards'], rewards_df)
+        # an all empty categorical (subtype) is read back as object column:
+        pd.testing.assert_frame_equal(frames['staking'].drop(columns='subtype'), staking_df.drop(columns='subtype'))
+        self.assertIsNone(ledger_cache.load_frames(ledger_cache.make_key('hash', 'USD', 'close'), ['rewards']))
+
+    def test_cleanup(self):
+        df = pd.DataFrame({'amount': range(1000)})
+        for i in range(3):
+            ledger_cache.store_frames(str(i), {'rewards': df})
+            past = time.time() - 100 + i
+            os.utime(ledger_cache.frame_path(str(i), 'rewards'), (past, past))
+        file_size = ledger_cache.frame_path('0', 'rewards').stat().st_size
+        ledger_cache.cleanup(max_bytes=2 * file_size)
+        self.assertIsNone(ledger_cache.load_frames('0', ['rewards']))
+        self.assertIsNotNone(ledger_cache.load_frames('2', ['rewards']))
+
+    def test_failed_store_leaves_no_tmp_file(self):
+        # mixed types cannot be written as parquet:
+        with self.assertRaises(Exception):
+            ledger_cache.store_frames('key', {'rewards': pd.DataFrame({'amount': [1, 'a']})})
+        self.assertEqual(list(ledger_cache.cache_dir.iterdir()), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
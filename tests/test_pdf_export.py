@@ -1,6 +1,9 @@
+import pathlib
+import re
 import unittest
 import pandas as pd
 import pdfkit
+import pdf_export
 
 
 class testPDFExport(unittest.TestCase):
@@ -13,4 +16,37 @@ class testPDFExport(unittest.TestCase):
         html = df.to_html()
 
         # create a PDF from the HTML string using pdfkit
-        pdfkit.from_string(html, 'output.pdf')
\ No newline at end of file
+        pdfkit.from_string(html, 'output.pdf')
+
+
+class TestReport(unittest.TestCase):
+
+    def setUp(self):
+        pdf_export.report_cache.clear()
+        self.sections = [pdf_export.report_section('0  SOL.S', b'\x89PNG sol', pd.DataFrame({'SOL.S': [1.0]}),
+                                                   '<p>Total reward received: 1.0 SOL</p>'),
+                         pdf_export.report_section('1  DOT.S', b'<svg>dot</svg>', image_format='svg')]
+        self.rendered = []
+
+    def renderer(self, html, options):
+        # the images have to exist while the renderer runs:
+        image_paths = re.findall(r'src="file://([^"]+)"', html)
+        self.rendered.append((html, [pathlib.Path(path).read_bytes() for path in image_paths]))
+        return b'%PDF-' + str(len(self.rendered)).encode()
+
+    def test_generate_report(self):
+        pdf = pdf_export.generate_report(self.sections, renderer=self.renderer)
+        self.assertEqual(pdf, b'%PDF-1')
+        html, images = self.rendered[0]
+        self.assertEqual(images, [b'\x89PNG sol', b'<svg>dot</svg>'])
+        self.assertNotIn('base64', html)
+        self.assertIn('0  SOL.S', html)
+        self.assertIn('Total reward received', html)
+        self.assertIn('<table', html)
+
+    def test_unchanged_report_is_not_rendered_again(self):
+        pdf_export.generate_report(self.sections, renderer=self.renderer)
+        self.assertEqual(pdf_export.generate_report(self.sections, renderer=self.renderer), b'%PDF-1')
+        self.assertEqual(len(self.rendered), 1)
+        self.sections[1]['image'] = b'<svg>changed</svg>'
+        self.assertEqual(pdf_export.generate_report(self.sections, renderer=self.renderer), b'%PDF-2')
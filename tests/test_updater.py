@@ -0,0 +1,105 @@
+import threading
+import time
+import unittest
+import data_requests
+import updater
+from stub_database import StubDatabaseTestCase, bars_end
+
+
+class TestUpdater(StubDatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.updater = updater.Updater(max_workers=2, intervals=(1440,))
+
+    def tearDown(self):
+        self.updater.executor.shutdown(wait=True)
+        super().tearDown()
+
+    def wait(self, ticker_list, timeout=10):
+        deadline = time.monotonic() + timeout
+        while self.updater.active(ticker_list):
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+
+    def test_sync_in_background(self):
+        ticker_list = ['DOTEUR', 'SOLEUR']
+        jobs = self.updater.submit(ticker_list, bars_end - 10 * 86400)
+        self.assertEqual(sorted(jobs), ticker_list)
+        self.wait(ticker_list)
+        status = self.updater.status(ticker_list)
+        self.assertEqual(status['SOLEUR'], {'state': 'done', 'progress': 1.0, 'bars': 10, 'error': None})
+        self.assertEqual(self.updater.eta(ticker_list), 0.0)
+        self.assertEqual(len(data_requests.get_ohlc_from_db('DOTEUR')), 10)
+        self.assertEqual(self.updater.status(['ADAEUR']), {})
+
+    def test_deduplicate_sessions(self):
+        # the sync blocks until both sessions submitted:
+        release = threading.Event()
+        sync_list_of_ohlc = data_requests.sync_list_of_ohlc
+
+        def blocking_sync(*args, **kwargs):
+            release.wait(5)
+            return sync_list_of_ohlc(*args, **kwargs)
+
+        data_requests.sync_list_of_ohlc = blocking_sync
+        try:
+            first = self.updater.submit(['SOLEUR'], bars_end - 10 * 86400)
+            second = self.updater.submit(['SOLEUR', 'DOTEUR'], bars_end - 10 * 86400)
+            self.assertIs(first['SOLEUR'], second['SOLEUR'])
+            self.assertTrue(self.updater.active(['SOLEUR']))
+            self.assertGreater(self.updater.eta(['SOLEUR']), 0)
+            release.set()
+            self.wait(['SOLEUR', 'DOTEUR'])
+        finally:
+            data_requests.sync_list_of_ohlc = sync_list_of_ohlc
+        self.assertEqual(sorted(self.server.requests), [('DOTEUR', bars_end - 10 * 86400),
+                                                        ('SOLEUR', bars_end - 10 * 86400)])
+
+    def test_earlier_start_is_synced_afterwards(self):
+        release = threading.Event()
+        sync_list_of_ohlc = data_requests.sync_list_of_ohlc
+
+        def blocking_sync(*args, **kwargs):
+            release.wait(5)
+            return sync_list_of_ohlc(*args, **kwargs)
+
+        data_requests.sync_list_of_ohlc = blocking_sync
+        try:
+            self.updater.submit(['SOLEUR'], bars_end - 10 * 86400)
+            while self.updater.jobs['SOLEUR'].state != 'running':
+                time.sleep(0.01)
+            self.updater.submit(['SOLEUR'], bars_end - 20 * 86400)
+            release.set()
+            self.wait(['SOLEUR'])
+        finally:
+            data_requests.sync_list_of_ohlc = sync_list_of_ohlc
+        self.assertEqual(len(data_requests.get_ohlc_from_db('SOLEUR')), 20)
+
+    def test_failed_sync(self):
+        retry_backoff = data_requests.retry_backoff
+        data_requests.retry_backoff = 0.01
+        self.server.rate_limited = data_requests.max_retries + 1
+        try:
+            self.updater.submit(['SOLEUR'], bars_end - 5 * 86400)
+            self.wait(['SOLEUR'])
+        finally:
+            data_requests.retry_backoff = retry_backoff
+        status = self.updater.status(['SOLEUR'])['SOLEUR']
+        self.assertEqual(status['state'], 'failed')
+        self.assertIn('Rate limit', status['error'])
+
+    def test_fallback(self):
+        self.server.unknown_pairs = {'KILTUSD'}
+        self.updater.submit(['KILTUSD', 'SOLUSD'], bars_end - 5 * 86400, {'KILTUSD': 'KILTEUR', 'SOLUSD': 'SOLEUR'})
+        self.wait(['KILTUSD', 'SOLUSD'])
+        status = self.updater.status(['KILTUSD', 'SOLUSD'])
+        self.assertEqual(status['KILTUSD']['state'], 'done')
+        self.assertEqual(status['KILTUSD']['bars'], 5)
+        self.assertEqual(len(data_requests.get_ohlc_from_db('KILTEUR')), 5)
+        # the fallback is only synced if the ticker fails:
+        self.assertIsNone(data_requests.get_sync_state('SOLEUR'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,153 @@
+import unittest
+import numpy as np
+import pandas as pd
+import benchmarks.kraken_stub as kraken_stub
+import data_requests
+from stub_database import StubDatabaseTestCase
+import valuation
+
+
+def price_loader(ticker, start=None, end=None, interval=1440):
+    # daily bars at midnight: 2023-01-01 .. 2023-01-03, no finer bars
+    if interval != 1440:
+        return pd.DataFrame({'timestamp': [], 'open': [], 'high': [], 'low': [], 'close': [], 'ticker': []})
+    return pd.DataFrame({'timestamp': [1672531200, 1672617600, 1672704000],
+                         'open': [1.0, 2.0, 3.0],
+                         'high': [1.5, 2.5, 3.5],
+                         'low': [0.5, 1.5, 2.5],
+                         'close': [1.0, 2.0, 3.0],
+                         'ticker': ticker})
+
+
+def hourly_price_loader(ticker, start=None, end=None, interval=1440):
+    # hourly bars of 2023-01-03 only, the hour of the day plus 10 as price:
+    if interval != 60:
+        return price_loader(ticker, start, end, interval)
+    timestamps = 1672704000 + 3600 * np.arange(24)
+    prices = 10.0 + np.arange(24)
+    return pd.DataFrame({'timestamp': timestamps, 'open': prices, 'high': prices, 'low': prices, 'close': prices,
+                         'ticker': ticker})
+
+
+class TestValuation(unittest.TestCase):
+
+    def setUp(self):
+        index = pd.to_datetime(['2023-01-01 01:00:00', '2023-01-02 02:00:00', '2023-01-03 03:00:00'])
+        self.rewards_df = pd.DataFrame({'SOL.S': [1.0, np.nan, 2.0], 'DOT.S': [np.nan, 4.0, 1.0]}, index=index)
+
+    def test_asset_to_ticker(self):
+        self.assertEqual(valuation.asset_to_ticker('SOL.S', 'EUR'), 'SOLEUR')
+        self.assertEqual(valuation.asset_to_ticker('FIS.S', 'USD'), 'FISUSD')
+
+    def test_value_rewards(self):
+        rewards_df, df_accumulated = valuation.value_rewards(self.rewards_df, ['SOL.S', 'DOT.S'], 'EUR', 'close',
+                                                             price_loader)
+        self.assertEqual(list(rewards_df['SOL.S_EUR'].fillna(-1)), [1.0, -1, 6.0])
+        self.assertEqual(list(rewards_df['SOL.S_EUR_ONREC'].fillna(-1)), [1.0, -1, 7.0])
+        self.assertEqual(list(df_accumulated['SOL.S_EUR_ACC'].fillna(-1)), [1.0, -1, 9.0])
+        self.assertEqual(list(df_accumulated['DOT.S_EUR_ACC'].fillna(-1)), [-1, 8.0, 15.0])
+        self.assertEqual(rewards_df['DOT.S_EUR'].dtype, np.float64)
+
+    def test_value_rewards_day_price(self):
+        rewards_df, _ = valuation.value_rewards(self.rewards_df, ['SOL.S'], 'USD', 'high', price_loader)
+        self.assertEqual(rewards_df['SOL.S_USD'].iloc[0], 1.5)
+
+    def test_finest_interval(self):
+        loaded = []
+
+        def loader(ticker, start=None, end=None, interval=1440):
+            loaded.append((interval, start, end))
+            return hourly_price_loader(ticker, start, end, interval)
+
+        rewards_df, df_accumulated = valuation.value_rewards(self.rewards_df, ['SOL.S'], 'EUR', 'close', loader)
+        # 2023-01-01 from the daily bar, 2023-01-03 03:00 from the hourly bar:
+        self.assertEqual(list(rewards_df['SOL.S_EUR'].fillna(-1)), [1.0, -1, 26.0])
+        self.assertEqual(list(df_accumulated['SOL.S_EUR_ACC'].fillna(-1)), [1.0, -1, 39.0])
+        # ranges start at the bar covering the first reward:
+        self.assertEqual(loaded, [(60, 1672534800, 1672714800), (1440, 1672531200, 1672714800)])
+
+        loaded.clear()
+        valuation.value_rewards(self.rewards_df.iloc[2:], ['SOL.S'], 'EUR', 'close', loader)
+        # all rewards are covered by hourly bars, daily bars are not loaded:
+        self.assertEqual([interval for interval, _, _ in loaded], [60])
+
+    def test_covering_prices(self):
+        prices = pd.Series([1.0, 2.0], index=[3600, 7200])
+        timestamps = np.array([0, 3600, 5000, 7199, 10799, 10800])
+        np.testing.assert_array_equal(valuation.covering_prices(timestamps, prices, 60),
+                                      [np.nan, 1.0, 1.0, 1.0, 2.0, np.nan])
+        self.assertTrue(np.isnan(valuation.covering_prices(timestamps, pd.Series(dtype=float), 60)).all())
+
+    def test_sync_tickers(self):
+        self.assertEqual(valuation.sync_tickers(['SOL.S', 'DOT.S'], 'EUR'), ['SOLUSD', 'DOTUSD', 'EURUSD'])
+        self.assertEqual(valuation.sync_tickers(['SOL.S'], 'USD'), ['SOLUSD'])
+        self.assertEqual(valuation.fallback_tickers(['SOL.S'], 'EUR'), {'SOLUSD': 'SOLEUR'})
+        self.assertEqual(valuation.fallback_tickers(['SOL.S'], 'USD'), {})
+        self.assertEqual(set(valuation.price_tickers(['SOL.S'], 'EUR')), {'SOLEUR', 'SOLUSD', 'USDEUR', 'EURUSD'})
+
+    def test_fx_triangulation(self):
+        loaded = []
+
+        def usd_loader(ticker, start=None, end=None, interval=1440):
+            loaded.append(ticker)
+            if ticker == 'EURUSD':
+                # 1 EUR = 2 USD
+                df = price_loader(ticker, start, end, interval)
+                return df.assign(close=2.0)
+            if ticker.endswith('USD'):
+                return price_loader(ticker, start, end, interval)
+            return price_loader(ticker, start, end, 60)
+
+        rewards_df, df_accumulated = valuation.value_rewards(self.rewards_df, ['SOL.S', 'DOT.S'], 'EUR', 'high',
+                                                             usd_loader, intervals=(1440,))
+        # high in USD at the EURUSD close:
+        self.assertEqual(list(rewards_df['SOL.S_EUR'].fillna(-1)), [0.75, -1, 3.5])
+        self.assertEqual(list(df_accumulated['DOT.S_EUR_ACC'].fillna(-1)), [-1, 5.0, 8.75])
+        # the fx series is loaded once for all assets:
+        self.assertEqual(loaded, ['SOLEUR', 'SOLUSD', 'USDEUR', 'EURUSD', 'DOTEUR', 'DOTUSD'])
+
+    def test_fx_inverted_pair(self):
+        def loader(ticker, start=None, end=None, interval=1440):
+            if ticker in ('SOLUSD', 'USDEUR'):
+                return price_loader(ticker, start, end, interval)
+            return price_loader(ticker, start, end, 60)
+
+        rewards_df, _ = valuation.value_rewards(self.rewards_df, ['SOL.S'], 'EUR', 'close', loader, intervals=(1440,))
+        # 1 EUR = 1 / USDEUR USD, SOLUSD close * USDEUR close:
+        self.assertEqual(list(rewards_df['SOL.S_EUR'].fillna(-1)), [1.0, -1, 18.0])
+
+    def test_missing_price(self):
+        def short_loader(ticker, start=None, end=None, interval=1440):
+            return price_loader(ticker, interval=interval).iloc[:1]
+        with self.assertRaises(data_requests.MissingPriceError):
+            valuation.value_rewards(self.rewards_df, ['SOL.S'], 'EUR', 'close', short_loader)
+
+
+class TestSyncPrices(StubDatabaseTestCase):
+    # 2022-12-25 .. 2023-01-04:
+    bars_start = 1671926400
+    bars_end = 1672790400
+
+    def setUp(self):
+        super().setUp()
+        # KILT is only listed in EUR:
+        self.server.unknown_pairs = {'KILTUSD'}
+        index = pd.to_datetime(['2023-01-01 01:00:00', '2023-01-02 02:00:00'])
+        self.rewards_df = pd.DataFrame({'SOL.S': [1.0, 2.0], 'KILT.S': [3.0, np.nan]}, index=index)
+
+    def test_asset_only_listed_in_base_currency(self):
+        report = valuation.sync_prices(['SOL.S', 'KILT.S'], 'EUR', 1671926400, intervals=(1440,))
+        self.assertEqual(sorted(report), ['EURUSD', 'KILTEUR', 'SOLUSD'])
+        self.assertFalse(any('error' in result for result in report.values()))
+        rewards_df, _ = valuation.value_rewards(self.rewards_df, ['SOL.S', 'KILT.S'], 'EUR', 'close',
+                                                intervals=(1440,))
+        self.assertAlmostEqual(rewards_df['KILT.S_EUR'][0], 3 * kraken_stub.bar_price('KILTEUR', 1672531200), 3)
+        self.assertFalse(rewards_df['SOL.S_EUR'].isna().any())
+
+    def test_failure_without_direct_pair(self):
+        report = valuation.sync_prices(['KILT.S'], 'USD', 1671926400, intervals=(1440,))
+        self.assertIn('Unknown asset pair', report['KILTUSD']['error'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,180 @@
+"""
+Background updates of the exchange database, shared by all sessions of the Streamlit server.
+
+A ticker requested by several sessions at once is synced once, the app keeps rendering from the stored prices
+while the sync runs and picks up the new rows on its next rerun.
+"""
+import collections
+import concurrent.futures
+import threading
+import time
+import data_requests as data_requests
+
+max_workers = 2
+# seconds a ticker sync is assumed to take until the first one finished:
+default_job_seconds = 2.0
+
+updater = None
+updater_lock = threading.Lock()
+
+
+class UpdateJob:
+    """
+    Sync of one ticker at all intervals of the store.
+    :param fallback: ticker synced instead if the sync of ticker fails, None for no fallback
+    """
+
+    def __init__(self, ticker, start, intervals, fallback=None):
+        self.ticker = ticker
+        self.fallback = fallback
+        self.start = start
+        self.intervals = tuple(intervals)
+        self.state = 'queued'
+        self.intervals_done = 0
+        self.bars = 0
+        self.error = None
+        self.submitted_at = time.monotonic()
+        self.started_at = None
+        self.finished_at = None
+        # earlier start requested while the job was running, synced by a follow-up job:
+        self.follow_up_start = None
+
+    def active(self):
+        return self.state in ('queued', 'running')
+
+    def status(self):
+        """
+        :return: dict with state ('queued', 'running', 'done', 'failed'), progress (0..1), bars and error
+        """
+        return {'state': self.state, 'progress': self.intervals_done / len(self.intervals),
+                'bars': self.bars, 'error': self.error}
+
+
+class Updater:
+    """
+    Runs ticker syncs in worker threads, one job per ticker at a time.
+    :param max_workers: number of tickers synced concurrently, the kraken rate limiter is shared by all of them
+    :param intervals: timeframes in minutes, defaults to data_requests.sync_intervals
+    """
+
+    def __init__(self, max_workers=max_workers, intervals=None):
+        self.intervals = data_requests.sync_intervals if intervals is None else intervals
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers,
+                                                              thread_name_prefix='updater')
+        self.max_workers = max_workers
+        self.lock = threading.Lock()
+        # ticker -> latest UpdateJob:
+        self.jobs = {}
+        # seconds of the latest finished jobs, for the ETA:
+        self.durations = collections.deque(maxlen=20)
+
+    def submit(self, ticker_list, start, fallbacks=None):
+        """
+        Queues a sync of every ticker that is not already queued or running from start or earlier.
+        :param ticker_list: list of str
+        :param start: linuxtmps
+        :param fallbacks: dict ticker -> ticker synced instead if its sync fails, e.g. valuation.fallback_tickers
+        :return: dict ticker -> UpdateJob
+        """
+        fallbacks = fallbacks or {}
+        submitted = {}
+        with self.lock:
+            for ticker in ticker_list:
+                job = self.jobs.get(ticker)
+                if job is not None and job.state == 'queued':
+                    job.start = min(job.start, start)
+                elif job is not None and job.state == 'running':
+                    if start < job.start:
+                        job.follow_up_start = start if job.follow_up_start is None else min(job.follow_up_start,
+                                                                                            start)
+                else:
+                    job = self.queue(ticker, start, fallbacks.get(ticker))
+                submitted[ticker] = job
+        return submitted
+
+    def queue(self, ticker, start, fallback=None):
+        job = UpdateJob(ticker, start, self.intervals, fallback)
+        self.jobs[ticker] = job
+        self.executor.submit(self.run, job)
+        return job
+
+    def run(self, job):
+        with self.lock:
+            job.state = 'running'
+            job.started_at = time.monotonic()
+            start = job.start
+
+        def progress(interval, report):
+            with self.lock:
+                job.intervals_done += 1
+                job.bars += report[job.ticker].get('bars', 0)
+
+        try:
+            report = data_requests.sync_list_of_ohlc([job.ticker], start, intervals=job.intervals,
+                                                     max_workers=1, progress=progress)[job.ticker]
+            error = report.get('error')
+            if error and job.fallback is not None:
+                report = data_requests.sync_list_of_ohlc([job.fallback], start, intervals=job.intervals,
+                                                         max_workers=1)[job.fallback]
+                if 'error' in report:
+                    error = f"{error}, {job.fallback}: {report['error']}"
+                else:
+                    error = None
+                    with self.lock:
+                        job.bars += report['bars']
+        # the worker thread must not die silently, e.g. on a locked database:
+        except Exception as e:
+            error = str(e)
+
+        with self.lock:
+            job.finished_at = time.monotonic()
+            job.state = 'failed' if error else 'done'
+            job.error = error
+            job.intervals_done = len(job.intervals)
+            self.durations.append(job.finished_at - job.started_at)
+            if job.follow_up_start is not None and self.jobs.get(job.ticker) is job:
+                self.queue(job.ticker, job.follow_up_start, job.fallback)
+
+    def status(self, ticker_list):
+        """
+        :param ticker_list: list of str
+        :return: dict ticker -> dict as returned by UpdateJob.status, tickers never submitted are left out
+        """
+        with self.lock:
+            return {ticker: self.jobs[ticker].status() for ticker in ticker_list if ticker in self.jobs}
+
+    def active(self, ticker_list):
+        """
+        :return: True while a sync of one of the tickers is queued or running
+        """
+        with self.lock:
+            return any(self.jobs[ticker].active() for ticker in ticker_list if ticker in self.jobs)
+
+    def eta(self, ticker_list):
+        """
+        Estimates the seconds until the syncs of the tickers are finished from the duration of recent jobs.
+        :param ticker_list: list of str
+        :return: float, 0 if nothing is queued or running
+        """
+        with self.lock:
+            job_seconds = sum(self.durations) / len(self.durations) if self.durations else default_job_seconds
+            now = time.monotonic()
+            # all queued jobs wait in one queue, the tickers of this list may be behind the others:
+            queued = sum(job.state == 'queued' for job in self.jobs.values())
+            running = [max(job_seconds - (now - job.started_at), 0.0)
+                       for ticker, job in self.jobs.items() if ticker in ticker_list and job.state == 'running']
+            if not running and not any(self.jobs[ticker].state == 'queued'
+                                       for ticker in ticker_list if ticker in self.jobs):
+                return 0.0
+            return max(running, default=0.0) + queued * job_seconds / self.max_workers
+
+
+def get_updater():
+    """
+    :return: Updater shared by all sessions of the process, started on first use
+    """
+    global updater
+    with updater_lock:
+        if updater is None:
+            updater = Updater()
+        return updater
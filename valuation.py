@@ -0,0 +1,292 @@
+import numpy as np
+import pandas as pd
+import data_requests as data_requests
+
+# currency the assets are synced in, rewards in other base currencies are converted with its fx pair:
+quote_currency = 'USD'
+# currencies tried, in order, when the direct pair of an asset in the base currency has no price:
+bridge_currencies = ('USD', 'EUR')
+# fx conversions are done at the close of the covering bar, independent of the price the rewards are sold on:
+fx_price = 'close'
+
+
+def asset_to_ticker(asset, base_currency):
+    """
+    :param asset: str (SOL.S)
+    :param base_currency: str (EUR)
+    :return: str (SOLEUR)
+    """
+    if asset.endswith('.S'):
+        asset = asset[:-len('.S')]
+    return asset + base_currency
+
+
+def sync_tickers(reward_assets, base_currency):
+    """
+    Tickers to download for valuing the assets in base_currency: every asset in the quote currency and the
+    fx pair of the base currency, so switching the base currency downloads nothing but one fx pair.
+    :param reward_assets: list of str (['SOL.S', 'DOT.S'])
+    :param base_currency: str ('EUR', 'USD')
+    :return: list of str (['SOLUSD', 'DOTUSD', 'EURUSD'])
+    """
+    ticker_list = [asset_to_ticker(asset, quote_currency) for asset in reward_assets]
+    if base_currency != quote_currency:
+        # kraken lists fiat pairs as <currency><USD>, e.g. EURUSD:
+        ticker_list.append(base_currency + quote_currency)
+    return ticker_list
+
+
+def fallback_tickers(reward_assets, base_currency):
+    """
+    Direct pairs to sync instead of the quote currency pair of an asset kraken does not list in the quote
+    currency, asset_prices prefers them anyway.
+    :param reward_assets: list of str (['SOL.S', 'DOT.S'])
+    :param base_currency: str ('EUR', 'USD')
+    :return: dict (quote currency ticker -> direct ticker), e.g. {'SOLUSD': 'SOLEUR'}, empty for the quote currency
+    """
+    if base_currency == quote_currency:
+        return {}
+    return {asset_to_ticker(asset, quote_currency): asset_to_ticker(asset, base_currency) for asset in reward_assets}
+
+
+def sync_prices(reward_assets, base_currency, start, **sync_args):
+    """
+    Syncs the sync_tickers of the assets, the direct pair of every asset whose quote currency pair failed.
+    :param reward_assets: list of str (['SOL.S', 'DOT.S'])
+    :param base_currency: str ('EUR', 'USD')
+    :param start: linuxtmps
+    :param sync_args: passed on to data_requests.sync_list_of_ohlc
+    :return: dict as returned by data_requests.sync_list_of_ohlc, a failed quote currency pair is replaced by
+    its direct pair if that one synced
+    """
+    report = data_requests.sync_list_of_ohlc(sync_tickers(reward_assets, base_currency), start, **sync_args)
+    fallbacks = {ticker: direct for ticker, direct in fallback_tickers(reward_assets, base_currency).items()
+                 if 'error' in report[ticker]}
+    if fallbacks:
+        fallback_report = data_requests.sync_list_of_ohlc(list(fallbacks.values()), start, **sync_args)
+        for ticker, direct in fallbacks.items():
+            if 'error' not in fallback_report[direct]:
+                del report[ticker]
+            report[direct] = fallback_report[direct]
+    return report
+
+
+def price_tickers(reward_assets, base_currency):
+    """
+    :return: list of str, every ticker value_rewards may read prices of, e.g. to key cached results by their sync time
+    """
+    ticker_list = [asset_to_ticker(asset, base_currency) for asset in reward_assets]
+    for bridge in bridge_currencies:
+        if bridge != base_currency:
+            ticker_list += [asset_to_ticker(asset, bridge) for asset in reward_assets]
+            ticker_list += [bridge + base_currency, base_currency + bridge]
+    return ticker_list
+
+
+def load_price_series(ticker, day_price, start=None, end=None, price_loader=None, interval=1440):
+    """
+    Loads the OHLC bars of a ticker within [start, end] with one range read and returns the selected price.
+    :param ticker: str (SOLEUR)
+    :param day_price: str ('close', 'low', 'high')
+    :param start: linux timestamp, None for all history
+    :param end: linux timestamp, None for all history
+    :param price_loader: callable(ticker, start, end, interval) -> pd.DataFrame,
+    defaults to data_requests.get_ohlc_from_db
+    :param interval: timeframe in minutes
+    :return: pd.Series of float indexed by the linux timestamp (int) of the bar start, sorted
+    """
+    if price_loader is None:
+        price_loader = data_requests.get_ohlc_from_db
+    ohlc_df = price_loader(ticker, start, end, interval)
+    prices = pd.Series(ohlc_df[day_price].astype(float).to_numpy(),
+                       index=ohlc_df['timestamp'].astype('int64').to_numpy())
+    return prices[~prices.index.duplicated(keep='last')].sort_index()
+
+
+def reward_timestamps(index):
+    """
+    :param index: pd.DatetimeIndex
+    :return: np.ndarray of linux timestamps (int64)
+    """
+    return (index.asi8 // 10 ** 9).astype('int64')
+
+
+def covering_prices(timestamps, prices, interval):
+    """
+    As-of join of timestamps onto bars: the price of the bar that started last before each timestamp,
+    if that bar still covers it.
+    :param timestamps: np.ndarray of linux timestamps
+    :param prices: pd.Series as returned by load_price_series
+    :param interval: timeframe in minutes of the bars
+    :return: np.ndarray of float, NaN where no bar covers the timestamp
+    """
+    if prices.empty:
+        return np.full(len(timestamps), np.nan)
+    bar_starts = prices.index.to_numpy(dtype=np.int64)
+    positions = np.searchsorted(bar_starts, timestamps, side='right') - 1
+    covered = (positions >= 0) & (timestamps < bar_starts[positions.clip(0)] + interval * 60)
+    return np.where(covered, prices.to_numpy(dtype=float)[positions.clip(0)], np.nan)
+
+
+def reward_prices(timestamps, intervals, load_prices):
+    """
+    Prices every timestamp at the finest bar covering it. Coarser intervals are only loaded while
+    timestamps are left without a price.
+    :param timestamps: np.ndarray of linux timestamps
+    :param intervals: timeframes in minutes
+    :param load_prices: callable(interval) -> pd.Series as returned by load_price_series
+    :return: np.ndarray of float, NaN where no interval has a covering bar
+    """
+    prices = np.full(len(timestamps), np.nan)
+    for interval in sorted(intervals):
+        missing = np.isnan(prices)
+        if not missing.any():
+            break
+        prices[missing] = covering_prices(timestamps[missing], load_prices(interval), interval)
+    return prices
+
+
+def fx_rates(currency, base_currency, timestamps, intervals, load_prices):
+    """
+    :param currency: str (USD)
+    :param base_currency: str (EUR)
+    :param timestamps: np.ndarray of linux timestamps
+    :param intervals: timeframes in minutes
+    :param load_prices: callable(ticker, field, interval) -> pd.Series as returned by load_price_series
+    :return: np.ndarray of float, units of base_currency per unit of currency, from either direction of the pair
+    (USDEUR or 1 / EURUSD), NaN where neither is stored
+    """
+    rates = reward_prices(timestamps, intervals,
+                          lambda interval: load_prices(currency + base_currency, fx_price, interval))
+    missing = np.isnan(rates)
+    if missing.any():
+        rates[missing] = 1 / reward_prices(timestamps[missing], intervals,
+                                           lambda interval: load_prices(base_currency + currency, fx_price, interval))
+    return rates
+
+
+def asset_prices(asset, base_currency, day_price, timestamps, intervals, load_prices):
+    """
+    Prices the asset in base_currency at the direct pair (SOLEUR) where it has a covering bar, else triangulated
+    through the bridge currencies (SOLUSD * USD in EUR).
+    :param asset: str (SOL.S)
+    :param base_currency: str ('EUR', 'USD')
+    :param day_price: str ('close', 'low', 'high')
+    :param timestamps: np.ndarray of linux timestamps
+    :param intervals: timeframes in minutes
+    :param load_prices: callable(ticker, field, interval) -> pd.Series as returned by load_price_series
+    :return: np.ndarray of float, NaN where no price could be found
+    """
+    prices = reward_prices(timestamps, intervals,
+                           lambda interval: load_prices(asset_to_ticker(asset, base_currency), day_price, interval))
+    for bridge in bridge_currencies:
+        missing = np.isnan(prices)
+        if not missing.any():
+            break
+        if bridge == base_currency:
+            continue
+        bridged = reward_prices(timestamps[missing], intervals,
+                                lambda interval: load_prices(asset_to_ticker(asset, bridge), day_price, interval))
+        if np.isnan(bridged).all():
+            continue
+        prices[missing] = bridged * fx_rates(bridge, base_currency, timestamps[missing], intervals, load_prices)
+    return prices
+
+
+def value_amounts(amounts, prices, ticker):
+    """
+    Values a column of asset amounts at the price of their timestamp.
+    :param amounts: pd.Series of float indexed by DatetimeIndex, NaN where nothing was received
+    :param prices: np.ndarray of float aligned with amounts, as returned by reward_prices
+    :param ticker: str, only used for error reporting
+    :return: pd.Series of float in base currency, NaN where amounts is NaN
+    """
+    received = ~np.isnan(amounts.to_numpy(dtype=float))
+    missing = received & np.isnan(prices)
+    if missing.any():
+        first_missing = amounts.index[missing][0]
+        raise data_requests.MissingPriceError(
+            f"ticker: {ticker} has no price for {first_missing} in database")
+    return pd.Series(amounts.to_numpy(dtype=float) * prices, index=amounts.index)
+
+
+def value_rewards(rewards_df, reward_assets, base_currency, day_price='close', price_loader=None, intervals=None):
+    """
+    Values every reward at the time it was received and the accumulated rewards at every reward timestamp,
+    at the finest stored bar covering the timestamp (e.g. the hourly bar, else the daily bar).
+    Assets without a price in base_currency are converted from a bridge currency, see asset_prices.
+    Each ticker is loaded once per interval, all values are computed column wise.
+    :param rewards_df: pd.DataFrame indexed by DatetimeIndex with one column of reward amounts per asset
+    :param reward_assets: list of str, columns of rewards_df to value (['SOL.S', 'DOT.S'])
+    :param base_currency: str ('EUR', 'USD')
+    :param day_price: str ('close', 'low', 'high'), price of the bar the rewards are valued at
+    :param price_loader: callable(ticker, start, end, interval) -> pd.DataFrame,
+    defaults to data_requests.get_ohlc_from_db
+    :param intervals: timeframes in minutes, defaults to data_requests.sync_intervals
+    :return: (rewards_df, df_accumulated)
+    rewards_df gets the columns <asset>_<base_currency> (value on receipt) and
+    <asset>_<base_currency>_ONREC (accumulated value on receipt, as if every reward was sold immediately),
+    df_accumulated holds the accumulated amounts and <asset>_<base_currency>_ACC (value of the accumulated amount).
+    """
+    if intervals is None:
+        intervals = data_requests.sync_intervals
+    appendix = '_' + base_currency
+    rewards_df = rewards_df.copy()
+    df_accumulated = rewards_df.cumsum()
+
+    on_receipt_columns = {}
+    timestamps = reward_timestamps(rewards_df.index)
+    # loaded series by (ticker, field, interval), fx series are shared by all assets:
+    price_series = {}
+
+    def load_prices(ticker, field, interval):
+        if (ticker, field, interval) not in price_series:
+            # from the start of the bar covering the first reward:
+            bar_start = int(timestamps.min()) // (interval * 60) * interval * 60
+            price_series[ticker, field, interval] = load_price_series(ticker, field, bar_start, int(timestamps.max()),
+                                                                      price_loader, interval)
+        return price_series[ticker, field, interval]
+
+    for asset in reward_assets:
+        ticker = asset_to_ticker(asset, base_currency)
+        # accumulated amounts are NaN where nothing was received as well, only these timestamps need a price:
+        received = rewards_df[asset].notna().to_numpy()
+        prices = np.full(len(timestamps), np.nan)
+        if received.any():
+            prices[received] = asset_prices(asset, base_currency, day_price, timestamps[received], intervals,
+                                            load_prices)
+        rewards_df[asset + appendix] = value_amounts(rewards_df[asset], prices, ticker)
+        df_accumulated[asset + appendix + '_ACC'] = value_amounts(df_accumulated[asset], prices, ticker)
+        on_receipt_columns[asset + appendix + '_ONREC'] = rewards_df[asset + appendix].cumsum()
+
+    if on_receipt_columns:
+        rewards_df = pd.concat([rewards_df, pd.DataFrame(on_receipt_columns, index=rewards_df.index)], axis=1)
+    return rewards_df, df_accumulated
+
+
+def summarize_rewards(rewards_df, df_accumulated, reward_assets, base_currency):
+    """
+    :param rewards_df: pd.DataFrame as returned by value_rewards
+    :param df_accumulated: pd.DataFrame as returned by value_rewards
+    :param reward_assets: list of str
+    :param base_currency: str ('EUR', 'USD')
+    :return: pd.DataFrame indexed by asset with the columns
+    from, to, total_reward, worth_last (value of all rewards at the last timestamp) and
+    worth_on_continuous_sale (value if every reward was sold on receipt). Assets without rewards are left out.
+    """
+    appendix = '_' + base_currency
+    rows = {}
+    for asset in reward_assets:
+        worth_last = df_accumulated[asset + appendix + '_ACC'].dropna()
+        worth_on_continuous_sale = rewards_df[asset + appendix + '_ONREC'].dropna()
+        if worth_last.empty or worth_on_continuous_sale.empty:
+            continue
+        rows[asset] = {'from': df_accumulated.index.min(),
+                       'to': df_accumulated.index.max(),
+                       'total_reward': df_accumulated[asset].max(),
+                       'worth_last': worth_last.iloc[-1],
+                       'worth_on_continuous_sale': worth_on_continuous_sale.iloc[-1]}
+    summary_df = pd.DataFrame.from_dict(
+        rows, orient='index', columns=['from', 'to', 'total_reward', 'worth_last', 'worth_on_continuous_sale'])
+    summary_df.index.name = 'asset'
+    return summary_df